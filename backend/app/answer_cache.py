@@ -0,0 +1,115 @@
+"""In-process semantic cache of RAG answers keyed by the embedded user question."""
+import re
+from collections import OrderedDict
+from time import time
+import numpy as np
+from app.config import settings
+
+_cache: "SemanticAnswerCache | None" = None
+
+
+def get_answer_cache() -> "SemanticAnswerCache":
+    global _cache
+    if _cache is None:
+        _cache = SemanticAnswerCache(
+            max_entries=settings.ANSWER_CACHE_MAX_ENTRIES,
+            ttl=settings.ANSWER_CACHE_TTL,
+            threshold=settings.ANSWER_CACHE_THRESHOLD,
+        )
+    return _cache
+
+
+def normalize_question(question: str) -> str:
+    return re.sub(r"\s+", " ", question).strip().strip("?!. ").lower()
+
+
+class SemanticAnswerCache:
+    """LRU + TTL cache of (question vector, answer) entries.
+
+    Entries remember the knowledge base version they were answered against, so a lookup
+    with a newer version (after re-indexing) never replays a stale answer.
+    """
+
+    def __init__(self, max_entries: int = 1000, ttl: int = 3600, threshold: float = 0.95):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.threshold = threshold
+        self._entries: OrderedDict[str, dict] = OrderedDict()
+        self._matrix: np.ndarray | None = None
+        self._keys: list[str] = []
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _rebuild(self):
+        self._keys = list(self._entries)
+        if self._keys:
+            self._matrix = np.stack([self._entries[k]["vector"] for k in self._keys])
+        else:
+            self._matrix = None
+
+    def _evict(self, key: str):
+        del self._entries[key]
+        self._matrix = None
+
+    def _is_valid(self, entry: dict, version: int) -> bool:
+        return entry["version"] == version and time() - entry["created"] <= self.ttl
+
+    def get_exact(self, question: str, version: int) -> dict | None:
+        """Return the entry for the same normalized question, skipping the embedding."""
+        key = normalize_question(question)
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if not self._is_valid(entry, version):
+            self._evict(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def lookup(self, vector, version: int) -> dict | None:
+        """Return the most similar valid entry whose cosine similarity clears the threshold."""
+        if not self._entries:
+            return None
+        if self._matrix is None:
+            self._rebuild()
+        query = _normalize(vector)
+        scores = self._matrix @ query
+        for i in np.argsort(-scores):
+            if scores[i] < self.threshold:
+                return None
+            key = self._keys[i]
+            entry = self._entries.get(key)
+            if entry is None:
+                continue
+            if not self._is_valid(entry, version):
+                self._evict(key)
+                continue
+            self._entries.move_to_end(key)
+            return entry
+        return None
+
+    def store(self, question: str, vector, answer: str, version: int) -> None:
+        key = normalize_question(question)
+        self._entries[key] = {
+            "question": question,
+            "vector": _normalize(vector),
+            "answer": answer,
+            "version": version,
+            "created": time(),
+        }
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        self._matrix = None
+
+    def invalidate(self) -> None:
+        self._entries.clear()
+        self._matrix = None
+        self._keys = []
+
+
+def _normalize(vector) -> np.ndarray:
+    v = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(v)
+    return v / norm if norm else v
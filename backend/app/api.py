@@ -4,9 +4,10 @@ from time import time
 from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Request
 from pydantic import BaseModel
 from sse_starlette.sse import EventSourceResponse
-from app.db import get_redis, create_chat, chat_exists
-from app.vector_db import get_qdrant
+from app.db import get_redis, create_chat
+from app.vector_db import get_vector_store
 from app.assistants.assistant import RAGAssistant
+from app.ollama_client import get_scheduler, get_pool
 from app.indexing import ingest_pdf_bytes
 
 logger = logging.getLogger(__name__)
@@ -14,6 +15,10 @@ logger = logging.getLogger(__name__)
 class ChatIn(BaseModel):
     message: str
 
+class NewChatIn(BaseModel):
+    # Pin the chat to these documents; searches then only cover their chunks
+    doc_names: list[str] | None = None
+
 # Get Redis db dependency
 async def get_rdb():
     rdb = get_redis()
@@ -53,19 +58,33 @@ async def index_pdf(request: Request, file: UploadFile | None = File(None)):
     return {'filename': file.filename, 'doc_name': doc_name, 'chunks_indexed': num_chunks}
 
 @router.post('/chats')
-async def create_new_chat(rdb=Depends(get_rdb)):
+async def create_new_chat(chat_in: NewChatIn | None = None, rdb=Depends(get_rdb)):
     chat_id = str(uuid4())[:8]
     created = int(time())
-    await create_chat(rdb, chat_id, created)
-    return {'id': chat_id}
+    doc_names = chat_in.doc_names if chat_in else None
+    await create_chat(rdb, chat_id, created, doc_names=doc_names)
+    return {'id': chat_id, 'doc_names': doc_names or []}
 
 @router.post('/chats/{chat_id}')
 async def chat(chat_id: str, chat_in: ChatIn):
     # Dependencies with yield don't work with Streaming responses after version 0.106
     rdb = get_redis()
-    if not await chat_exists(rdb, chat_id):
-        raise HTTPException(status_code=404, detail=f'Chat {chat_id} does not exist')
-    vector_db = get_qdrant()
+    vector_db = get_vector_store()
     assistant = RAGAssistant(chat_id=chat_id, rdb=rdb, vector_db=vector_db)
+    # Existence check, history, pinned documents and KB version in a single round trip
+    if not await assistant.load():
+        await rdb.aclose()
+        raise HTTPException(status_code=404, detail=f'Chat {chat_id} does not exist')
     sse_stream = assistant.run(message=chat_in.message)
-    return EventSourceResponse(sse_stream, background=rdb.aclose)
\ No newline at end of file
+    return EventSourceResponse(sse_stream, background=rdb.aclose)
+
+@router.get('/llm/queue')
+async def llm_queue():
+    """Admission scheduler state: active generations, queue depth and wait times."""
+    return get_scheduler().stats()
+
+
+@router.get('/llm/backends')
+async def llm_backends():
+    """Ollama pool state: health and outstanding requests per backend."""
+    return get_pool().stats()
@@ -1,92 +1,156 @@
 import asyncio
-from openai import pydantic_function_tool
+import json
+import logging
+from functools import cache
 from time import time
-from app.ollama_client import chat_stream
-from app.db import get_chat_messages, add_chat_messages
-from app.assistants.tools import QueryKnowledgeBaseTool
+from app.ollama_client import chat_stream, QueueTimeoutError, PRIORITY_ANSWER, tool_schema_from_pydantic
+from app.db import load_chat_turn, add_chat_messages
+from app.embeddings import get_embedding
+from app.answer_cache import get_answer_cache
+from app.assistants.context import ContextBuilder, select_history
 from app.assistants.prompts import MAIN_SYSTEM_PROMPT, RAG_SYSTEM_PROMPT
 from app.utils.sse_stream import SSEStream
+from app.tokenizer import token_size
+from app.config import settings
+from app.metrics import ANSWER_CACHE, start_trace, end_trace
+
+logger = logging.getLogger(__name__)
+
+@cache
+def fixed_prompt_tokens():
+    """Tokens sent on every turn regardless of history: the larger of the two passes' system prompt (+ tool schema).
+    The schema is measured as sent to Ollama.
+    """
+    tools_schema = json.dumps(tool_schema_from_pydantic())
+    return max(token_size(MAIN_SYSTEM_PROMPT) + token_size(tools_schema), token_size(RAG_SYSTEM_PROMPT))
+
+def get_history_token_budget(message_tokens, max_budget=None):
+    """Tokens left for chat history once the prompts, the new message, retrieved context and the answer are accounted for."""
+    available = (
+        settings.OLLAMA_CONTEXT_LENGTH
+        - settings.RESPONSE_TOKEN_RESERVE
+        - settings.CONTEXT_TOKEN_BUDGET
+        - fixed_prompt_tokens()
+        - message_tokens
+    )
+    return max(0, min(max_budget or settings.HISTORY_TOKEN_BUDGET, available))
 
 class RAGAssistant:
-    def __init__(self, chat_id, rdb, vector_db=None, history_size=4, max_tool_calls=3):
+    def __init__(self, chat_id, rdb, vector_db=None, doc_names=None, history_size=None, history_token_budget=None, max_tool_calls=3):
         self.chat_id = chat_id
         self.rdb = rdb
         self.vector_db = vector_db
+        self.doc_names = doc_names  # documents the chat is pinned to (None = whole knowledge base)
         self.sse_stream = None
         self.main_system_message = {'role': 'system', 'content': MAIN_SYSTEM_PROMPT}
         self.rag_system_message = {'role': 'system', 'content': RAG_SYSTEM_PROMPT}
-        self.tools_schema = [pydantic_function_tool(QueryKnowledgeBaseTool)]
-        self.history_size = history_size
+        self.history_size = history_size or settings.HISTORY_MAX_MESSAGES
+        self.history_token_budget = history_token_budget or settings.HISTORY_TOKEN_BUDGET
         self.max_tool_calls = max_tool_calls
+        self.context = None
+        self.history = None
+        self.kb_version = 0
+        # Knowledge base searches started while the first-pass generation is still streaming
+        self._searches: dict[str, asyncio.Task] = {}
 
     async def _generate_chat_response(self, system_message, chat_messages, **kwargs):
         messages = [system_message, *chat_messages]
-        tools_passed = kwargs.get('tools')
-        if tools_passed:
-            print(f"\n[Assistant] Passing {len(tools_passed)} tool(s) to chat_stream")
-        else:
-            print(f"\n[Assistant] No tools passed to chat_stream")
-        async with chat_stream(messages=messages, **kwargs) as stream:
+        prefetch = bool(kwargs.get('tools'))
+        async with chat_stream(messages=messages, chat_id=self.chat_id, **kwargs) as stream:
             async for event in stream:
                 if event.type == 'content.delta':
                     await self.sse_stream.send(event.delta)
+                elif event.type == 'tool_call' and prefetch and len(self._searches) < self.max_tool_calls:
+                    # Start retrieval now so it overlaps with the rest of the stream
+                    kb_tool = event.tool_call.function.parsed_arguments
+                    self._searches[event.tool_call.id] = asyncio.create_task(kb_tool.search(self.vector_db, self.doc_names))
             final_completion = await stream.get_final_completion()
             assistant_message = final_completion.choices[0].message
             return assistant_message
 
     async def _handle_tool_calls(self, tool_calls, chat_messages):
-        print(f"\n→ Executing {len(tool_calls[:self.max_tool_calls])} tool call(s)...")
-        for i, tool_call in enumerate(tool_calls[:self.max_tool_calls], 1):
-            kb_tool = tool_call.function.parsed_arguments
-            query = getattr(kb_tool, 'query_input', 'unknown')
-            print(f"  [{i}] QueryKnowledgeBaseTool(query_input='{query}')")
-            kb_result = await kb_tool(self.vector_db)
-            print(f"  [{i}] ✓ Tool returned {len(kb_result)} chars of results")
+        tool_calls = tool_calls[:self.max_tool_calls]
+        # Searches normally started during the stream; start any that weren't and run them together
+        searches = [
+            self._searches.pop(tc.id, None) or asyncio.create_task(tc.function.parsed_arguments.search(self.vector_db, self.doc_names))
+            for tc in tool_calls
+        ]
+        context = self.context = ContextBuilder()
+        for tool_call, chunks in zip(tool_calls, await asyncio.gather(*searches)):
+            logger.debug("QueryKnowledgeBaseTool(query_input=%r) returned %d chunk(s)", tool_call.function.parsed_arguments.query_input, len(chunks))
+            context.add(tool_call.id, chunks)
+        kb_results = await context.build_with_texts(self.vector_db)
+        for tool_call in tool_calls:
             chat_messages.append(
-                {'role': 'tool', 'tool_call_id': tool_call.id, 'content': kb_result}
+                {'role': 'tool', 'tool_call_id': tool_call.id, 'content': kb_results[tool_call.id]}
             )
-        print("→ Generating final response with retrieved context...\n")
         return await self._generate_chat_response(
             system_message=self.rag_system_message,
             chat_messages=chat_messages,
+            priority=PRIORITY_ANSWER,
         )
     
+    async def _lookup_cached_answer(self, message, kb_version):
+        answer_cache = get_answer_cache()
+        entry = answer_cache.get_exact(message, kb_version)
+        query_vector = None
+        if entry is None:
+            query_vector = await get_embedding(message)
+            entry = answer_cache.lookup(query_vector, kb_version)
+        return entry, query_vector
+
+    async def load(self):
+        """Read the chat's recent history, pinned documents and the KB version in one round trip.
+        Returns False if the chat doesn't exist.
+        """
+        turn = await load_chat_turn(self.rdb, self.chat_id, max_messages=self.history_size)
+        if turn is None:
+            return False
+        self.history = turn['history']
+        self.doc_names = self.doc_names or turn['doc_names'] or None
+        self.kb_version = turn['kb_version']
+        return True
+
     async def _run_conversation_step(self, message):
-        user_db_message = {'role': 'user', 'content': message, 'created': int(time())}
-        chat_messages = await get_chat_messages(self.rdb, self.chat_id, last_n=self.history_size)
+        message_tokens = token_size(message)
+        user_db_message = {'role': 'user', 'content': message, 'tokens': message_tokens, 'created': int(time())}
+        if self.history is None:
+            await self.load()
+        history = self.history or []
+
+        # Only standalone questions (first in a chat) are cached: follow-ups depend on the history.
+        # Cached answers come from the whole knowledge base, so chats pinned to documents skip the cache.
+        use_answer_cache = settings.ANSWER_CACHE_ENABLED and not history and not self.doc_names
+        if use_answer_cache:
+            kb_version = self.kb_version
+            cached, query_vector = await self._lookup_cached_answer(message, kb_version)
+            ANSWER_CACHE.inc(result='hit' if cached else 'miss')
+            if cached:
+                await self.sse_stream.send(cached['answer'])
+                assistant_db_message = {
+                    'role': 'assistant',
+                    'content': cached['answer'],
+                    'tool_calls': [],
+                    'cached': True,
+                    'created': int(time())
+                }
+                await add_chat_messages(self.rdb, self.chat_id, [user_db_message, assistant_db_message])
+                return
+
+        chat_messages = select_history(history, get_history_token_budget(message_tokens, self.history_token_budget))
         chat_messages.append({'role': 'user', 'content': message})
         assistant_message = await self._generate_chat_response(
             system_message=self.main_system_message,
             chat_messages=chat_messages,
-            tools=self.tools_schema
+            tools=True,
         )
         tool_calls = getattr(assistant_message, 'tool_calls', None) or []
-        if tool_calls:
-            print(f"\n✓ Model called {len(tool_calls)} tool(s):")
-            for tc in tool_calls:
-                name = getattr(tc.function, 'name', 'unknown')
-                args = getattr(tc.function, 'arguments', '{}')
-                if isinstance(args, str):
-                    import json
-                    try:
-                        args = json.loads(args)
-                    except:
-                        pass
-                print(f"  - {name}: {args}")
-                # Verify it's not a mock - check if it has the expected structure
-                if hasattr(tc, 'function') and hasattr(tc.function, 'parsed_arguments'):
-                    print(f"    ✓ Tool call has parsed_arguments (real tool call)")
-                else:
-                    print(f"    ⚠ Tool call structure may be incomplete")
-        else:
-            print("\n⚠ Model did NOT call any tools")
-
         if tool_calls:
             chat_messages.append(assistant_message)
             assistant_message = await self._handle_tool_calls(tool_calls, chat_messages)
         else:
             # No tool calls - return the assistant's response as-is (may not have document context)
-            print("  → Proceeding without RAG - model did not call tool")
+            logger.debug("Model answered chat %s without calling a tool", self.chat_id)
 
         tool_calls_list = getattr(assistant_message, 'tool_calls', None) or tool_calls
         assistant_db_message = {
@@ -98,14 +162,24 @@ class RAGAssistant:
             'created': int(time())
         }
         await add_chat_messages(self.rdb, self.chat_id, [user_db_message, assistant_db_message])
+        # Only answers grounded in retrieved passages are worth replaying
+        if use_answer_cache and tool_calls and assistant_message.content:
+            get_answer_cache().store(message, query_vector, assistant_message.content, kb_version)
 
     async def _handle_conversation_task(self, message):
+        start_trace()
         try:
             await self._run_conversation_step(message)
-        except Exception as e:
-            # TODO: Improve error handling (send SSE message to client)
-            print(f'Error: {str(e)}')
+        except QueueTimeoutError:
+            await self.sse_stream.send_error('The assistant is busy right now. Please try again in a moment.')
+        except Exception:
+            logger.exception("Conversation step failed for chat %s", self.chat_id)
+            await self.sse_stream.send_error('Something went wrong while generating the answer.')
         finally:
+            for search in self._searches.values():
+                search.cancel()
+            self._searches.clear()
+            end_trace(f'chat {self.chat_id}')
             await self.sse_stream.close()
 
     def run(self, message):
@@ -0,0 +1,201 @@
+"""Token-budgeted context assembly for retrieved knowledge base chunks."""
+from app.tokenizer import token_size
+from app.config import settings
+from app.vector_db import fetch_chunk_texts
+
+SOURCE_SEPARATOR = "\n\n---\n\n"
+NO_SOURCES = "No relevant passages found in the knowledge base."
+NO_NEW_SOURCES = "No additional relevant passages beyond those returned by the other searches."
+NO_SOURCES_FIT = "Passages were found but none fit in the context budget; try a narrower search."
+# Tokens added by format_source around a chunk's text (SOURCE line, quotes, separator)
+SOURCE_FORMAT_TOKENS = 10
+
+
+def format_source(doc_name: str, text: str) -> str:
+    return f"SOURCE: {doc_name}\n\"\"\"\n{text}\n\"\"\""
+
+
+def format_sources(sources: list[dict]) -> str:
+    return SOURCE_SEPARATOR.join(format_source(s["doc_name"], s["text"]) for s in sources) + "\n\n---"
+
+
+def _split_chunk_id(chunk_id: str) -> tuple[str, int | None]:
+    """Split '<doc_id>:<index>' chunk ids produced by indexing; unknown formats have no index."""
+    doc_id, _, idx = chunk_id.rpartition(":")
+    if doc_id and idx.isdigit():
+        return doc_id, int(idx)
+    return chunk_id, None
+
+
+def _merge_overlap(left: str, right: str) -> str:
+    """Join two consecutive chunks, dropping the text they share at the boundary."""
+    if right in left:
+        return left
+    max_overlap = min(len(left), len(right), max(settings.CHUNK_OVERLAP, 0) * 2)
+    for k in range(max_overlap, 0, -1):
+        if left.endswith(right[:k]):
+            return left + right[k:]
+    return left + "\n" + right
+
+
+class ContextBuilder:
+    """Collect chunks from every knowledge base search in a turn and pack them into a token budget.
+
+    Chunks are deduplicated by chunk id and by text, packed greedily by score, and adjacent
+    chunks of the same document are merged so their overlapping text is only sent once.
+    Each packed source is attributed to the search (group) that scored it highest.
+
+    Chunks may arrive without text (slim search results carrying only ids, scores and token
+    counts); their text is fetched after packing, only for the chunks that made the cut.
+    """
+
+    def __init__(self, token_budget: int | None = None):
+        self.token_budget = token_budget or settings.CONTEXT_TOKEN_BUDGET
+        self._chunks: dict[str, dict] = {}
+        self._texts: dict[str, str] = {}
+        self._groups: dict[str, int] = {}
+        self._selected: list[dict] | None = None
+
+    def add(self, group: str, chunks: list[dict]) -> None:
+        self._groups[group] = self._groups.get(group, 0) + len(chunks)
+        self._selected = None
+        for chunk in chunks:
+            text = chunk.get("text")
+            if text is None:
+                # Not fetched yet: can only dedupe by id
+                key = chunk["chunk_id"]
+            elif not text.strip():
+                continue
+            else:
+                key = self._texts.setdefault(text, chunk.get("chunk_id") or text)
+            existing = self._chunks.get(key)
+            if existing is None:
+                self._chunks[key] = {**chunk, "chunk_id": key, "group": group}
+            elif chunk.get("score", 0) > existing.get("score", 0):
+                existing["score"] = chunk["score"]
+                existing["group"] = group
+
+    @staticmethod
+    def _source_tokens(chunk: dict) -> int:
+        if chunk.get("text") is not None:
+            return token_size(format_source(chunk["doc_name"], chunk["text"]))
+        tokens = chunk.get("tokens") or settings.CHUNK_SIZE // 4
+        return tokens + token_size(chunk["doc_name"]) + SOURCE_FORMAT_TOKENS
+
+    def pack(self) -> list[dict]:
+        """Select the highest scoring chunks that fit the token budget."""
+        if self._selected is not None:
+            return self._selected
+        selected = []
+        used = 0
+        for chunk in sorted(self._chunks.values(), key=lambda c: c.get("score", 0), reverse=True):
+            tokens = self._source_tokens(chunk)
+            if used + tokens > self.token_budget:
+                continue
+            selected.append(chunk)
+            used += tokens
+        self._selected = selected
+        return selected
+
+    def missing_text_ids(self) -> list[str]:
+        """Point ids of packed chunks whose text still has to be fetched."""
+        return [c["id"] for c in self.pack() if c.get("text") is None]
+
+    def set_texts(self, texts: dict[str, str]) -> None:
+        for chunk in self.pack():
+            if chunk.get("text") is None and chunk["id"] in texts:
+                chunk["text"] = texts[chunk["id"]]
+
+    async def build_with_texts(self, store=None) -> dict[str, str]:
+        """Pack, fetch the text of the packed chunks that came without it, then build."""
+        missing = self.missing_text_ids()
+        if missing:
+            self.set_texts(await fetch_chunk_texts(missing, client=store))
+        return self.build()
+
+    def _merge_adjacent(self, chunks: list[dict]) -> list[dict]:
+        def position(c):
+            doc_id, idx = _split_chunk_id(c["chunk_id"])
+            return doc_id, idx if idx is not None else -1, c["chunk_id"]
+
+        merged = []
+        prev_doc, prev_idx = None, None
+        for chunk in sorted(chunks, key=position):
+            doc_id, idx = _split_chunk_id(chunk["chunk_id"])
+            if merged and idx is not None and prev_idx is not None and doc_id == prev_doc and idx == prev_idx + 1:
+                span = merged[-1]
+                span["text"] = _merge_overlap(span["text"], chunk["text"])
+                if chunk.get("score", 0) > span.get("score", 0):
+                    span["score"] = chunk["score"]
+                    span["group"] = chunk["group"]
+            else:
+                merged.append(dict(chunk))
+            prev_doc, prev_idx = doc_id, idx
+        return merged
+
+    def build(self) -> dict[str, str]:
+        """Return the formatted context for each group; groups left without sources get a short note."""
+        spans = self._merge_adjacent([c for c in self.pack() if c.get("text")])
+        spans.sort(key=lambda s: s.get("score", 0), reverse=True)
+        by_group: dict[str, list[dict]] = {g: [] for g in self._groups}
+        for span in spans:
+            by_group[span["group"]].append(span)
+        return {group: self._format_group(group, by_group) for group in by_group}
+
+    def _format_group(self, group: str, by_group: dict[str, list[dict]]) -> str:
+        if by_group[group]:
+            return format_sources(by_group[group])
+        if not self._groups[group]:
+            return NO_SOURCES
+        # Its chunks were either sent under another search or cut by the budget
+        if any(spans for other, spans in by_group.items() if other != group):
+            return NO_NEW_SOURCES
+        return NO_SOURCES_FIT
+
+
+def _compact_history(messages: list[dict], token_budget: int) -> dict | None:
+    """Condense older turns into a single note listing the earlier user questions, newest first."""
+    header = "Summary of earlier conversation. The user previously asked:"
+    lines = []
+    used = token_size(header)
+    for m in reversed(messages):
+        if m["role"] != "user":
+            continue
+        question = " ".join(m["content"].split())
+        line = f"- {question[:200]}{'...' if len(question) > 200 else ''}"
+        tokens = token_size(line)
+        if used + tokens > token_budget:
+            break
+        lines.append(line)
+        used += tokens
+    if not lines:
+        return None
+    return {"role": "system", "content": "\n".join([header, *reversed(lines)])}
+
+
+def select_history(messages: list[dict], token_budget: int, compact: bool | None = None) -> list[dict]:
+    """Keep the newest messages that fit token_budget, using the per-message 'tokens' counts.
+
+    With compaction enabled, the turns that didn't fit are replaced by a short summary
+    using whatever budget is left. The window never starts with an assistant message
+    whose question was cut off.
+    """
+    compact = settings.HISTORY_COMPACTION if compact is None else compact
+    count = 0
+    used = 0
+    for m in reversed(messages):
+        if used + m["tokens"] > token_budget:
+            break
+        count += 1
+        used += m["tokens"]
+    start = len(messages) - count
+    while start < len(messages) and messages[start]["role"] != "user":
+        used -= messages[start]["tokens"]
+        start += 1
+    selected = [{"role": m["role"], "content": m["content"]} for m in messages[start:]]
+    older = messages[:start]
+    if compact and older:
+        summary = _compact_history(older, token_budget - used)
+        if summary:
+            selected.insert(0, summary)
+    return selected
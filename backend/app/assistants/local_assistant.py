@@ -1,21 +1,23 @@
 import asyncio
 from rich.console import Console
-from openai import pydantic_function_tool
 from app.db import get_redis
-from app.vector_db import get_qdrant
+from app.vector_db import get_vector_store
 from app.ollama_client import chat_stream
-from app.assistants.tools import QueryKnowledgeBaseTool
+from app.assistants.context import ContextBuilder, select_history
+from app.assistants.assistant import get_history_token_budget
+from app.tokenizer import token_size
+from app.config import settings
 from app.assistants.prompts import MAIN_SYSTEM_PROMPT, RAG_SYSTEM_PROMPT
 
 class LocalRAGAssistant:
-    def __init__(self, rdb, vector_db, history_size=4, max_tool_calls=3, log_tool_calls=True, log_tool_results=False):
+    def __init__(self, rdb, vector_db, history_size=None, max_tool_calls=3, log_tool_calls=True, log_tool_results=False):
         self.console = Console()
         self.rdb = rdb
         self.vector_db = vector_db
         self.chat_history = []
         self.main_system_message = {'role': 'system', 'content': MAIN_SYSTEM_PROMPT}
         self.rag_system_message = {'role': 'system', 'content': RAG_SYSTEM_PROMPT}
-        self.history_size = history_size
+        self.history_size = history_size or settings.HISTORY_MAX_MESSAGES
         self.max_tool_calls = max_tool_calls
         self.log_tool_calls = log_tool_calls
         self.log_tool_results = log_tool_results
@@ -35,24 +37,30 @@ class LocalRAGAssistant:
     async def run(self):
         self.console.print('How can I help you?\n', style='cyan')
         while True:
-            chat_messages = self.chat_history[-self.history_size:]
             user_input = input()
             self.console.print()
+            user_tokens = token_size(user_input)
+            chat_messages = select_history(self.chat_history[-self.history_size:], get_history_token_budget(user_tokens))
             user_message = {'role': 'user', 'content': user_input}
             chat_messages.append(user_message)
             assistant_message = await self._generate_chat_response(
                 system_message=self.main_system_message,
                 chat_messages=chat_messages,
-                tools=[pydantic_function_tool(QueryKnowledgeBaseTool)],
+                tools=True,
             )
 
             if assistant_message.tool_calls:
                 chat_messages.append(assistant_message)
-                for tool_call in assistant_message.tool_calls[:self.max_tool_calls]:
+                tool_calls = assistant_message.tool_calls[:self.max_tool_calls]
+                context = ContextBuilder()
+                for tool_call in tool_calls:
                     if self.log_tool_calls:
                         self.console.print(f'TOOL CALL: {tool_call.function.name}', style='red', end='\n\n')
                     kb_tool = tool_call.function.parsed_arguments
-                    kb_result = await kb_tool(self.vector_db)
+                    context.add(tool_call.id, await kb_tool.search(self.vector_db))
+                kb_results = await context.build_with_texts(self.vector_db)
+                for tool_call in tool_calls:
+                    kb_result = kb_results[tool_call.id]
                     if self.log_tool_results:
                         self.console.print(f'TOOL RESULT:\n{kb_result}', style='magenta', end='\n\n')
                     chat_messages.append(
@@ -64,14 +72,14 @@ class LocalRAGAssistant:
                 )
 
             self.chat_history.extend([
-                user_message,
-                {'role': 'assistant', 'content': assistant_message.content}
+                {**user_message, 'tokens': user_tokens},
+                {'role': 'assistant', 'content': assistant_message.content, 'tokens': token_size(assistant_message.content)}
             ])
 
 
 async def run_local_assistant():
     rdb = get_redis()
-    vector_db = get_qdrant()
+    vector_db = get_vector_store()
     try:
         await LocalRAGAssistant(rdb, vector_db).run()
     finally:
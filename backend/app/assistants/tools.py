@@ -1,15 +1,44 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, field_validator
 from app.vector_db import search_vector_db
 from app.embeddings import get_embedding
+from app.assistants.context import ContextBuilder
 
 class QueryKnowledgeBaseTool(BaseModel):
     """Search the document knowledge base to retrieve relevant passages. ALWAYS use this tool when the user asks ANY question about document content, facts, summaries, or information from indexed documents. Extract key search terms from the user's question and use them as the query_input. Examples: "machine learning", "financial summary", "project timeline", "key findings"."""
     query_input: str = Field(
         description='A clear, concise search query extracted from the user\'s question. Use 2-5 key words or a short phrase. Examples: "machine learning applications", "Q4 financial results", "project milestones", "safety protocols". Do NOT include question words like "what", "how", "why" - just the search terms.'
     )
+    doc_names: list[str] | None = Field(
+        default=None,
+        description='Only when the user asks about specific documents: their exact names as shown after "SOURCE:" in earlier results. Otherwise leave empty to search all documents.'
+    )
+
+    @field_validator('doc_names', mode='before')
+    @classmethod
+    def _as_name_list(cls, value):
+        # Models often send a single name as a plain string, or mix empty/non-string entries into the list
+        if isinstance(value, str):
+            return [value] if value.strip() else None
+        if isinstance(value, list):
+            return [v for v in value if isinstance(v, str) and v.strip()] or None
+        return value
 
-    async def __call__(self, vector_db):
+    def scope(self, pinned_doc_names=None):
+        """Documents to search: the requested ones, limited to the chat's pinned documents if it has any."""
+        if not pinned_doc_names:
+            return self.doc_names or None
+        return [name for name in self.doc_names or () if name in pinned_doc_names] or list(pinned_doc_names)
+
+    async def search(self, vector_db, doc_names=None):
         query_vector = await get_embedding(self.query_input)
-        chunks = await search_vector_db(query_vector, client=vector_db)
-        formatted_sources = [f"SOURCE: {c['doc_name']}\n\"\"\"\n{c['text']}\n\"\"\"" for c in chunks]
-        return "\n\n---\n\n".join(formatted_sources) + "\n\n---"
+        scope = self.scope(doc_names)
+        hits = await search_vector_db(query_vector, client=vector_db, doc_names=scope)
+        if not hits and scope and not doc_names:
+            # The model named documents that don't exist (made up or misspelled): search everything instead
+            hits = await search_vector_db(query_vector, client=vector_db)
+        return hits
+
+    async def __call__(self, vector_db, token_budget=None, doc_names=None):
+        context = ContextBuilder(token_budget=token_budget)
+        context.add(self.query_input, await self.search(vector_db, doc_names))
+        return (await context.build_with_texts(vector_db))[self.query_input]
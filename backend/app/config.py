@@ -2,25 +2,78 @@ from pydantic_settings import BaseSettings, SettingsConfigDict
 
 class Settings(BaseSettings):
     ALLOW_ORIGINS: str = '*'
+    LOG_LEVEL: str = 'INFO'
+    # Log a per-request breakdown of timed stages (embedding, search, Redis, ...)
+    TRACE_REQUESTS: bool = False
     # LLM: Ollama (local)
     OLLAMA_HOST: str = 'http://localhost:11434'
+    # Comma-separated Ollama endpoints to load balance across (defaults to OLLAMA_HOST). Kept separate
+    # from OLLAMA_HOST because the ollama package itself reads that variable as a single URL.
+    OLLAMA_HOSTS: str = ''
+    OLLAMA_MAX_FAILURES: int = 2
+    OLLAMA_PROBE_INTERVAL: float = 10.0
+    OLLAMA_STICKY_SLACK: int = 2
     OLLAMA_MODEL: str = 'Qwen-0.6B'
+    OLLAMA_CONTEXT_LENGTH: int = 4096
+    # How long Ollama keeps the model loaded after a request (also set by the startup warm-up ping)
+    OLLAMA_KEEP_ALIVE: str = '30m'
+    # Admission control: concurrent generations sent to Ollama, and how long a request may wait for a slot
+    OLLAMA_MAX_CONCURRENT: int = 4
+    OLLAMA_QUEUE_TIMEOUT: float = 60.0
     # Embeddings (sentence-transformers, local)
     EMBEDDING_MODEL: str = 'BAAI/bge-small-en-v1.5'
     EMBEDDING_DIMENSIONS: int = 384  # bge-small-en-v1.5 output dimension
+    # Torch threads per API worker for embedding (0 = CPU cores / workers when forking workers, else torch's default)
+    EMBEDDING_THREADS: int = 0
+    # API worker processes started by app.serve; they share the loaded model copy-on-write
+    WEB_CONCURRENCY: int = 1
     # Vector DB: Qdrant
     QDRANT_URL: str = 'http://98.92.135.201:6334'
     QDRANT_GRPC: bool = True
     QDRANT_COLLECTION: str = 'documents'
+    # Vector quantization for new collections: 'none', 'scalar' (int8) or 'binary'; quantized vectors stay in RAM
+    QDRANT_QUANTIZATION: str = 'none'
+    # Keep original float32 vectors on disk (used only for rescoring when quantized)
+    QDRANT_ON_DISK_VECTORS: bool = False
+    QDRANT_RESCORE: bool = True
+    QDRANT_OVERSAMPLING: float = 2.0
+    # Search without chunk text; fetch text only for the hits kept in the LLM context
+    QDRANT_LAZY_TEXT: bool = True
+    CHUNK_TEXT_CACHE_SIZE: int = 2048
+    # Vector store backend: 'qdrant' or 'embedded' (in-process memory-mapped index, single node)
+    VECTOR_STORE: str = 'qdrant'
+    EMBEDDED_INDEX_PATH: str = 'data/index'
+    # Rows after which the embedded index switches to HNSW search (needs hnswlib; 0 = always exact)
+    EMBEDDED_HNSW_THRESHOLD: int = 50000
     # Chat history: Redis
     REDIS_HOST: str = 'localhost'
     REDIS_PORT: int = 6379
+    # Chat history window: newest messages that fit the token budget (out of the last HISTORY_MAX_MESSAGES)
+    HISTORY_TOKEN_BUDGET: int = 1024
+    HISTORY_MAX_MESSAGES: int = 20
+    # Condense older turns that don't fit the budget into a short summary instead of dropping them
+    HISTORY_COMPACTION: bool = False
+    # Semantic answer cache: replay answers to near-identical standalone questions
+    ANSWER_CACHE_ENABLED: bool = True
+    ANSWER_CACHE_THRESHOLD: float = 0.95
+    ANSWER_CACHE_MAX_ENTRIES: int = 1000
+    ANSWER_CACHE_TTL: int = 3600  # seconds
+    # Tokens kept free in the LLM context for the generated answer
+    RESPONSE_TOKEN_RESERVE: int = 512
     EXPORT_DIR: str = 'data'
     VECTOR_SEARCH_TOP_K: int = 10
+    UPSERT_BATCH_SIZE: int = 256
+    # Max tokens of retrieved passages sent to the LLM per turn (across all tool calls)
+    CONTEXT_TOKEN_BUDGET: int = 1536
     # Indexing: fixed-size chunking (chars)
     CHUNK_SIZE: int = 1000
     CHUNK_OVERLAP: int = 200
 
     model_config = SettingsConfigDict(env_file='.env')
 
+    @property
+    def ollama_hosts(self) -> list[str]:
+        hosts = [h.strip() for h in self.OLLAMA_HOSTS.split(',') if h.strip()]
+        return hosts or [self.OLLAMA_HOST]
+
 settings = Settings()
\ No newline at end of file
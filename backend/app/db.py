@@ -1,16 +1,36 @@
 import json
-from redis.asyncio import Redis
+from time import time
+from redis.asyncio import ConnectionPool, Redis
 from redis.commands.search.field import NumericField
 from redis.commands.search.index_definition import IndexDefinition, IndexType
 from redis.commands.search.query import Query
 from redis.commands.json.path import Path
 from app.config import settings
+from app.tokenizer import token_size
+from app.metrics import REDIS
 
 CHAT_IDX_NAME = 'idx:chat'
 CHAT_IDX_PREFIX = 'chat:'
+KB_VERSION_KEY = 'kb:version'
+KB_DOCS_KEY = 'kb:docs'  # content hash -> JSON {doc_name, doc_id, chunks} of every indexed file
+
+# Appends messages and updates the chat's metadata atomically in one round trip.
+# ARGV[1] is the last-activity timestamp, the rest are JSON-encoded messages.
+APPEND_MESSAGES_SCRIPT = """
+local count = redis.call('JSON.ARRAPPEND', KEYS[1], '$.messages', unpack(ARGV, 2))
+redis.call('JSON.SET', KEYS[1], '$.message_count', count[1])
+redis.call('JSON.SET', KEYS[1], '$.last_active', ARGV[1])
+return count[1]
+"""
+
+_pool: ConnectionPool | None = None
 
 def get_redis():
-    return Redis(host=settings.REDIS_HOST, port=settings.REDIS_PORT)
+    """Client on the process-wide connection pool; closing it returns its connection to the pool."""
+    global _pool
+    if _pool is None:
+        _pool = ConnectionPool(host=settings.REDIS_HOST, port=settings.REDIS_PORT)
+    return Redis(connection_pool=_pool)
 
 
 # CHATS
@@ -27,26 +47,65 @@ async def create_chat_index(rdb):
     except Exception as e:
         print(f"Error creating chat index '{CHAT_IDX_NAME}': {e}")
 
-async def create_chat(rdb, chat_id, created):
-    chat = {'id': chat_id, 'created': created, 'messages': []}
+@REDIS.timed(op='create_chat')
+async def create_chat(rdb, chat_id, created, doc_names=None):
+    chat = {
+        'id': chat_id,
+        'created': created,
+        'last_active': created,
+        'message_count': 0,
+        'doc_names': doc_names or [],
+        'messages': [],
+    }
     await rdb.json().set(CHAT_IDX_PREFIX + chat_id, Path.root_path(), chat)
     return chat
 
-async def add_chat_messages(rdb, chat_id, messages):
-    await rdb.json().arrappend(CHAT_IDX_PREFIX + chat_id, '$.messages', *messages)
+def _with_token_count(message):
+    if 'tokens' in message:
+        return message
+    return {**message, 'tokens': token_size(message.get('content') or '')}
 
-async def chat_exists(rdb, chat_id):
-    return await rdb.exists(CHAT_IDX_PREFIX + chat_id)
+def _history(messages):
+    history = []
+    for m in messages or []:
+        message = {'role': m['role'], 'content': m['content'] or ''}
+        if 'tokens' in m:
+            message['tokens'] = m['tokens']
+        history.append(_with_token_count(message))
+    return history
+
+@REDIS.timed(op='add_chat_messages')
+async def add_chat_messages(rdb, chat_id, messages):
+    """Append messages and update last_active and message_count atomically (one script call)."""
+    # Token counts are stored with each message so history windows never re-tokenize old messages
+    messages = [_with_token_count(m) for m in messages]
+    last_active = max((m.get('created', 0) for m in messages), default=0) or int(time())
+    append = rdb.register_script(APPEND_MESSAGES_SCRIPT)
+    return await append(keys=[CHAT_IDX_PREFIX + chat_id], args=[last_active, *(json.dumps(m) for m in messages)])
 
-async def get_chat_messages(rdb, chat_id, last_n=None):
-    if last_n is None:
-        messages = await rdb.json().get(CHAT_IDX_PREFIX + chat_id, '$.messages[*]')
-    else:
-        messages = await rdb.json().get(CHAT_IDX_PREFIX + chat_id, f'$.messages[-{last_n}:]')
-    return [{'role': m['role'], 'content': m['content']} for m in messages] if messages else []
+@REDIS.timed(op='load_chat_turn')
+async def load_chat_turn(rdb, chat_id, max_messages=None):
+    """Everything a chat turn reads, pipelined into one round trip.
+    Returns None if the chat doesn't exist, else {history, doc_names, kb_version}.
+    """
+    max_messages = max_messages or settings.HISTORY_MAX_MESSAGES
+    key = CHAT_IDX_PREFIX + chat_id
+    async with rdb.pipeline(transaction=False) as pipe:
+        pipe.exists(key)
+        pipe.json().get(key, f'$.messages[-{max_messages}:]')
+        pipe.json().get(key, '$.doc_names[*]')
+        pipe.get(KB_VERSION_KEY)
+        exists, messages, doc_names, version = await pipe.execute()
+    if not exists:
+        return None
+    return {
+        'history': _history(messages),
+        'doc_names': doc_names or [],
+        'kb_version': int(version) if version else 0,
+    }
 
 async def get_chat(rdb, chat_id):
-    return await rdb.json().get(chat_id)
+    return await rdb.json().get(CHAT_IDX_PREFIX + chat_id)
 
 async def get_all_chats(rdb):
     q = Query('*').sort_by('created', asc=False)
@@ -55,6 +114,21 @@ async def get_all_chats(rdb):
     return [json.loads(doc.json) for doc in res.docs]
 
 
+# KNOWLEDGE BASE
+@REDIS.timed(op='bump_kb_version')
+async def bump_kb_version(rdb):
+    return await rdb.incr(KB_VERSION_KEY)
+
+@REDIS.timed(op='get_indexed_docs')
+async def get_indexed_docs(rdb):
+    docs = await rdb.hgetall(KB_DOCS_KEY)
+    return {key.decode(): json.loads(value) for key, value in docs.items()}
+
+@REDIS.timed(op='add_indexed_doc')
+async def add_indexed_doc(rdb, content_hash, doc):
+    await rdb.hset(KB_DOCS_KEY, content_hash, json.dumps(doc))
+
+
 # GENERAL
 async def setup_db(rdb):
     try:
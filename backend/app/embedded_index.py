@@ -0,0 +1,318 @@
+"""Embedded in-process vector index: a memory-mapped float32 matrix of normalized vectors plus JSONL payloads.
+
+Files in the index directory:
+  vectors.f32     raw row-major float32 matrix, one normalized vector per row
+  payloads.jsonl  one JSON payload per row, in the same order
+
+Search is an exact dot-product top-k over the mapped matrix (BLAS matmul + argpartition).
+Past HNSW threshold rows, if hnswlib is installed, a background thread builds an HNSW graph
+(saved as hnsw.bin and extended after restarts); searches stay exact until it is ready.
+Searches filtered by document score only that document's rows (kept in a per-document row index).
+
+Adding a payload whose "id" is already indexed is an upsert: the new row is appended and the
+old one becomes a tombstone that searches skip. On load the last row written for an id wins,
+so tombstones need no separate file.
+
+Only one process may open an index: it holds an exclusive lock on the index.lock file
+while open, so the bulk loader cannot append under a running API server.
+"""
+import fcntl
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class IndexLockedError(Exception):
+    """Raised when another process already has the index open."""
+
+VECTORS_FILE = "vectors.f32"
+PAYLOADS_FILE = "payloads.jsonl"
+HNSW_FILE = "hnsw.bin"
+LOCK_FILE = "index.lock"
+HNSW_BATCH = 4096  # rows added to the graph per hold of its lock
+
+
+class EmbeddedVectorIndex:
+    def __init__(self, path: str, dim: int, hnsw_threshold: int = 0):
+        self.path = Path(path)
+        self.dim = dim
+        self.hnsw_threshold = hnsw_threshold
+        self._lock = threading.Lock()
+        self._vectors = np.zeros((0, dim), dtype=np.float32)
+        self._payloads: list[dict] = []
+        self._doc_rows: dict[str, list[int]] = {}
+        self._id_rows: dict[str, int] = {}  # payload id -> its current row
+        self._dead: set[int] = set()  # rows replaced by a later row with the same id
+        self._dead_idx = np.zeros(0, dtype=np.int64)  # sorted snapshot of _dead for vectorized masking
+        self._hnsw_deleted: set[int] = set()  # tombstones already marked deleted in the HNSW graph
+        self._hnsw = None  # graph over rows [0, _hnsw_count)
+        self._hnsw_count = 0
+        self._hnsw_lock = threading.Lock()  # guards the graph; add() never takes it
+        self._hnsw_builder: threading.Thread | None = None
+        self.path.mkdir(parents=True, exist_ok=True)
+        # Kept open for the life of the index; the OS drops the lock when the process exits
+        self._lock_file = open(self.path / LOCK_FILE, "w")
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self._lock_file.close()
+            raise IndexLockedError(f"Embedded index at {self.path} is in use by another process (stop the API server before bulk loading)") from None
+        self._load()
+
+    def __len__(self):
+        return len(self._payloads) - len(self._dead)
+
+    @property
+    def _vectors_path(self) -> Path:
+        return self.path / VECTORS_FILE
+
+    @property
+    def _payloads_path(self) -> Path:
+        return self.path / PAYLOADS_FILE
+
+    @property
+    def _hnsw_path(self) -> Path:
+        return self.path / HNSW_FILE
+
+    def _load(self):
+        payloads = self._read_payloads()
+        size = self._vectors_path.stat().st_size if self._vectors_path.exists() else 0
+        rows = size // (self.dim * 4)
+        # An interrupted write can leave one file ahead of the other, or end either one mid-row;
+        # trust only rows complete in both
+        count = min(rows, len(payloads))
+        if size != count * self.dim * 4 or count != len(payloads):
+            logger.warning("Embedded index at %s is inconsistent (%d bytes of vectors, %d payloads); truncating to %d rows", self.path, size, len(payloads), count)
+            self._rewrite(count, payloads[:count])
+        self._payloads = payloads[:count]
+        self._index_rows(0)
+        self._map(count)
+        self._load_hnsw(count)
+
+    def _read_payloads(self) -> list[dict]:
+        if not self._payloads_path.exists():
+            return []
+        with open(self._payloads_path) as f:
+            lines = [line for line in f if line.strip()]
+        payloads = [json.loads(line) for line in lines[:-1]]
+        if lines:
+            try:
+                payloads.append(json.loads(lines[-1]))
+            except json.JSONDecodeError:
+                # Last line cut off by an interrupted write; _load rewrites the file without it
+                logger.warning("Ignoring truncated last payload in %s", self._payloads_path)
+        return payloads
+
+    def _index_rows(self, start: int):
+        for row in range(start, len(self._payloads)):
+            payload = self._payloads[row]
+            self._doc_rows.setdefault(payload.get("doc_name", ""), []).append(row)
+            point_id = payload.get("id")
+            if point_id is not None:
+                previous = self._id_rows.get(point_id)
+                if previous is not None:
+                    self._dead.add(previous)
+                self._id_rows[point_id] = row
+        self._dead_idx = np.fromiter(sorted(self._dead), dtype=np.int64, count=len(self._dead))
+
+    def _rewrite(self, count: int, payloads: list[dict]):
+        # The saved graph may cover rows that are being dropped
+        self._hnsw_path.unlink(missing_ok=True)
+        if self._vectors_path.exists():
+            os.truncate(self._vectors_path, count * self.dim * 4)
+        with open(self._payloads_path, "w") as f:
+            f.writelines(json.dumps(p) + "\n" for p in payloads)
+
+    def _map(self, count: int):
+        if count:
+            self._vectors = np.memmap(self._vectors_path, dtype=np.float32, mode="r", shape=(count, self.dim))
+        else:
+            self._vectors = np.zeros((0, self.dim), dtype=np.float32)
+
+    def add(self, vectors, payloads: list[dict]) -> None:
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        if len(vectors) != len(payloads):
+            raise ValueError(f"Got {len(vectors)} vectors for {len(payloads)} payloads")
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms == 0, 1, norms)
+        lines = "".join(json.dumps(p) + "\n" for p in payloads)
+        with self._lock:
+            vectors_size = self._vectors_path.stat().st_size if self._vectors_path.exists() else 0
+            payloads_size = self._payloads_path.stat().st_size if self._payloads_path.exists() else 0
+            try:
+                with open(self._vectors_path, "ab") as f:
+                    f.write(vectors.tobytes())
+                with open(self._payloads_path, "a") as f:
+                    f.write(lines)
+            except BaseException:
+                # Roll both files back so vector rows and payload lines stay paired
+                if self._vectors_path.exists():
+                    os.truncate(self._vectors_path, vectors_size)
+                if self._payloads_path.exists():
+                    os.truncate(self._payloads_path, payloads_size)
+                raise
+            start = len(self._payloads)
+            self._payloads.extend(payloads)
+            self._index_rows(start)
+            self._map(len(self._payloads))
+
+    def search(self, query_vector, top_k: int, doc_names: list[str] | None = None) -> list[tuple[float, dict]]:
+        """Return (cosine score, payload) for the top_k most similar rows, optionally only rows of doc_names."""
+        query = np.asarray(query_vector, dtype=np.float32).reshape(self.dim)
+        norm = np.linalg.norm(query)
+        if norm:
+            query = query / norm
+        vectors, payloads, dead = self._vectors, self._payloads, self._dead_idx
+        count = len(vectors)
+        if not count:
+            return []
+        if doc_names:
+            return self._search_rows(query, top_k, vectors, payloads, doc_names)
+        dead = dead[dead < count]
+        top_k = min(top_k, count - len(dead))
+        if top_k <= 0:
+            return []
+        if self.hnsw_threshold and count >= self.hnsw_threshold:
+            hits = self._search_hnsw(query, top_k, vectors, dead)
+            if hits is not None:
+                return [(score, payloads[i]) for score, i in hits]
+        scores = vectors @ query
+        scores[dead] = -np.inf
+        if top_k < count:
+            idx = np.argpartition(-scores, top_k - 1)[:top_k]
+        else:
+            idx = np.arange(count)
+        idx = idx[np.argsort(-scores[idx])]
+        return [(float(scores[i]), payloads[i]) for i in idx]
+
+    def _search_rows(self, query, top_k, vectors, payloads, doc_names) -> list[tuple[float, dict]]:
+        dead = self._dead
+        rows = [
+            row for name in set(doc_names) for row in self._doc_rows.get(name, ())
+            if row < len(vectors) and row not in dead
+        ]
+        if not rows:
+            return []
+        rows = np.asarray(rows)
+        scores = vectors[rows] @ query
+        top_k = min(top_k, len(rows))
+        idx = np.argpartition(-scores, top_k - 1)[:top_k] if top_k < len(rows) else np.arange(len(rows))
+        idx = idx[np.argsort(-scores[idx])]
+        return [(float(scores[i]), payloads[rows[i]]) for i in idx]
+
+    def _search_hnsw(self, query: np.ndarray, top_k: int, vectors: np.ndarray, dead: np.ndarray):
+        """Graph search over the rows built so far plus exact search over the rest; None until a graph exists."""
+        self._start_hnsw_build()
+        # Never wait on the builder: while it holds the graph, search exactly
+        if not self._hnsw_lock.acquire(blocking=False):
+            return None
+        try:
+            if self._hnsw is None:
+                return None
+            indexed = min(self._hnsw_count, len(vectors))
+            self._mark_hnsw_deleted(dead)
+            k = min(top_k, indexed - len(self._hnsw_deleted))
+            hits = []
+            if k > 0:
+                self._hnsw.set_ef(max(64, k * 2))
+                try:
+                    labels, distances = self._hnsw.knn_query(query, k=k)
+                except RuntimeError:
+                    return None  # hnswlib found fewer than k live neighbours
+                # hnswlib's "ip" distance is 1 - dot product
+                hits = [(1.0 - float(d), int(i)) for i, d in zip(labels[0], distances[0])]
+        finally:
+            self._hnsw_lock.release()
+        if indexed < len(vectors):
+            scores = vectors[indexed:] @ query
+            scores[dead[dead >= indexed] - indexed] = -np.inf
+            hits += [(float(score), indexed + i) for i, score in enumerate(scores) if score != -np.inf]
+        return sorted(hits, reverse=True)[:top_k]
+
+    def _mark_hnsw_deleted(self, dead: np.ndarray):
+        # dead is sorted, so the tombstones inside the graph are a prefix of it
+        dead = dead[:np.searchsorted(dead, self._hnsw_count)]
+        if len(dead) == len(self._hnsw_deleted):
+            return
+        for row in dead.tolist():
+            if row not in self._hnsw_deleted:
+                try:
+                    self._hnsw.mark_deleted(row)
+                except RuntimeError:
+                    pass  # already marked in a graph loaded from disk
+                self._hnsw_deleted.add(row)
+
+    def _start_hnsw_build(self):
+        with self._lock:
+            if self._hnsw_builder is not None or self._hnsw_count >= len(self._vectors):
+                return
+            self._hnsw_builder = threading.Thread(target=self._build_hnsw, name="hnsw-build", daemon=True)
+            self._hnsw_builder.start()
+
+    def _build_hnsw(self):
+        """Add the rows missing from the graph in batches, then save it; runs in a background thread."""
+        added = 0
+        try:
+            import hnswlib
+            while True:
+                with self._lock:
+                    vectors = self._vectors
+                    if self._hnsw_count >= len(vectors):
+                        self._hnsw_builder = None
+                        break
+                start, end = self._hnsw_count, min(len(vectors), self._hnsw_count + HNSW_BATCH)
+                batch = np.asarray(vectors[start:end])
+                with self._hnsw_lock:
+                    if self._hnsw is None:
+                        self._hnsw = hnswlib.Index(space="ip", dim=self.dim)
+                        self._hnsw.init_index(max_elements=max(len(vectors) * 2, 1024), ef_construction=200, M=16)
+                    elif end > self._hnsw.get_max_elements():
+                        self._hnsw.resize_index(max(len(vectors), end) * 2)
+                    self._hnsw.add_items(batch, np.arange(start, end))
+                    self._hnsw_count = end
+                added += end - start
+            if added >= HNSW_BATCH:
+                with self._hnsw_lock:
+                    self._save_hnsw()
+        except ImportError:
+            logger.info("hnswlib is not installed; the embedded index searches exactly")
+            with self._lock:
+                self.hnsw_threshold = 0
+                self._hnsw_builder = None
+        except Exception:
+            logger.exception("Building the HNSW graph for %s failed; searching exactly", self.path)
+            with self._lock:
+                self.hnsw_threshold = 0
+                self._hnsw_builder = None
+
+    def _save_hnsw(self):
+        tmp = self._hnsw_path.with_suffix(".tmp")
+        self._hnsw.save_index(str(tmp))
+        os.replace(tmp, self._hnsw_path)
+        logger.info("Saved HNSW graph of %d rows to %s", self._hnsw_count, self._hnsw_path)
+
+    def _load_hnsw(self, count: int):
+        """Load the saved graph, then build the rows it lacks in the background."""
+        if not self.hnsw_threshold or count < self.hnsw_threshold:
+            return
+        try:
+            import hnswlib
+        except ImportError:
+            logger.info("hnswlib is not installed; the embedded index searches exactly")
+            self.hnsw_threshold = 0
+            return
+        if self._hnsw_path.exists():
+            index = hnswlib.Index(space="ip", dim=self.dim)
+            try:
+                index.load_index(str(self._hnsw_path), max_elements=max(count * 2, 1024))
+            except Exception:
+                logger.warning("Ignoring unreadable HNSW graph %s", self._hnsw_path, exc_info=True)
+            else:
+                if index.get_current_count() <= count:
+                    self._hnsw, self._hnsw_count = index, index.get_current_count()
+        self._start_hnsw_build()
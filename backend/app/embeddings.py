@@ -1,33 +1,63 @@
-"""Embeddings using BAAI/bge-small-en-v1.5 via sentence-transformers."""
+"""Embeddings using BAAI/bge-small-en-v1.5 via sentence-transformers.
+
+Vectors are returned as contiguous float32 NumPy arrays (1-D for one text, 2-D for a batch)
+so they can be handed to the vector store without boxing every float. Pass as_list=True
+to get plain Python lists instead.
+
+sentence-transformers (and torch) are imported on first use, not at import time; the API
+server loads the model during startup warm-up (see app/warmup.py).
+"""
 import asyncio
-from sentence_transformers import SentenceTransformer
+import numpy as np
 from app.config import settings
+from app.metrics import EMBEDDING
 
-_model: SentenceTransformer | None = None
+_model = None
 
 
 def _get_model():
     global _model
     if _model is None:
+        from sentence_transformers import SentenceTransformer
         _model = SentenceTransformer(settings.EMBEDDING_MODEL)
     return _model
 
 
-def _encode(text: str) -> list[float]:
-    return _get_model().encode(text, convert_to_numpy=True).tolist()
+def _encode(text: str) -> np.ndarray:
+    return np.ascontiguousarray(_get_model().encode(text, convert_to_numpy=True), dtype=np.float32)
+
+
+def _encode_batch(texts: list[str]) -> np.ndarray:
+    vectors = _get_model().encode(texts, convert_to_numpy=True)
+    return np.ascontiguousarray(vectors, dtype=np.float32).reshape(len(texts), -1)
 
 
-def _encode_batch(texts: list[str]) -> list[list[float]]:
-    return _get_model().encode(texts, convert_to_numpy=True).tolist()
+def load_model() -> None:
+    """Load the model weights without running inference, so it is safe to fork afterwards."""
+    _get_model()
 
 
-async def get_embedding(input: str, **kwargs) -> list[float]:
-    """Return embedding vector for a single string (async)."""
+def set_num_threads(threads: int) -> None:
+    import torch
+    torch.set_num_threads(threads)
+
+
+async def get_embedding(input: str, as_list: bool = False, **kwargs) -> np.ndarray | list[float]:
+    """Return the embedding vector for a single string (async), shape (dim,)."""
     loop = asyncio.get_event_loop()
-    return await loop.run_in_executor(None, _encode, input)
+    with EMBEDDING.time(kind='query'):
+        vector = await loop.run_in_executor(None, _encode, input)
+    return vector.tolist() if as_list else vector
 
 
-async def get_embeddings(input: list[str], **kwargs) -> list[list[float]]:
-    """Return embedding vectors for a list of strings (async)."""
+async def get_embeddings(input: list[str], as_list: bool = False, **kwargs) -> np.ndarray | list[list[float]]:
+    """Return embedding vectors for a list of strings (async), shape (len(input), dim)."""
     loop = asyncio.get_event_loop()
-    return await loop.run_in_executor(None, _encode_batch, input)
+    with EMBEDDING.time(kind='batch'):
+        vectors = await loop.run_in_executor(None, _encode_batch, input)
+    return vectors.tolist() if as_list else vectors
+
+
+async def warm_up() -> None:
+    """Load the model and run one encode so the first query doesn't pay for either."""
+    await asyncio.to_thread(_encode, 'warm up')
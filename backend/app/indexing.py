@@ -1,11 +1,18 @@
 """PDF ingestion: extract text, chunk, embed, and upsert into Qdrant."""
-from io import BytesIO
-from uuid import uuid4
-from pdfminer.high_level import extract_text
+import asyncio
+import hashlib
+from time import time
+from uuid import NAMESPACE_URL, uuid5
+import numpy as np
+from app.utils.pdf import extract_pdf_text
 from app.utils.splitter import FixedSizeCharSplitter
 from app.embeddings import get_embeddings
-from app.vector_db import add_chunks_to_vector_db, ensure_collection
+from app.vector_db import add_chunks_to_vector_db
+from app.db import get_redis, bump_kb_version, add_indexed_doc
+from app.answer_cache import get_answer_cache
 from app.config import settings
+from app.tokenizer import token_size
+from app.metrics import INDEXING
 
 
 def batchify(iterable, batch_size: int):
@@ -13,42 +20,63 @@ def batchify(iterable, batch_size: int):
         yield iterable[i : i + batch_size]
 
 
-async def ingest_pdf_bytes(pdf_bytes: bytes, doc_name: str) -> int:
-    """
-    Extract text from PDF bytes, chunk with fixed size (chars), embed, and upsert to Qdrant.
-    Returns the number of chunks indexed.
-    """
-    text = extract_text(BytesIO(pdf_bytes))
-    if not text or not text.strip():
-        return 0
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
 
+
+def make_chunks(text: str, doc_name: str, doc_hash: str) -> list[dict]:
+    """Split a document's text into chunk dicts ready for embedding and upsert.
+    Ids derive from the content hash, so re-ingesting the same file overwrites its points instead of duplicating them.
+    """
     splitter = FixedSizeCharSplitter(
         chunk_size=settings.CHUNK_SIZE,
         chunk_overlap=settings.CHUNK_OVERLAP,
     )
-    doc_chunks = splitter.split(text)
-    doc_id = str(uuid4())[:8]
+    doc_id = doc_hash[:8]
+    uploaded_at = int(time())
     chunks = []
-    for chunk_idx, chunk_text in enumerate(doc_chunks):
+    for chunk_idx, chunk_text in enumerate(splitter.split(text or '')):
         chunks.append({
-            "id": uuid4(),
+            "id": uuid5(NAMESPACE_URL, f"{doc_hash}:{chunk_idx}"),
             "chunk_id": f"{doc_id}:{chunk_idx + 1:04}",
             "text": chunk_text,
+            "tokens": token_size(chunk_text),
             "doc_name": doc_name,
-            "vector": None,
+            "doc_id": doc_id,
+            "uploaded_at": uploaded_at,
         })
+    return chunks
+
+
+async def ingest_pdf_bytes(pdf_bytes: bytes, doc_name: str) -> int:
+    """
+    Extract text from PDF bytes, chunk with fixed size (chars), embed, and upsert to Qdrant.
+    Returns the number of chunks indexed.
+    """
+    with INDEXING.time(stage='extract'):
+        text = await asyncio.to_thread(extract_pdf_text, pdf_bytes)
+    if not text or not text.strip():
+        return 0
 
+    doc_hash = content_hash(pdf_bytes)
+    with INDEXING.time(stage='chunk'):
+        chunks = make_chunks(text, doc_name, doc_hash)
     if not chunks:
         return 0
 
-    # Embed in batches
-    vectors = []
-    for batch in batchify(chunks, batch_size=64):
-        batch_vectors = await get_embeddings([c["text"] for c in batch])
-        vectors.extend(batch_vectors)
-    for chunk, vector in zip(chunks, vectors):
-        chunk["vector"] = vector
+    # Embed in batches straight into one (n_chunks, dim) float32 matrix
+    vectors = np.empty((len(chunks), settings.EMBEDDING_DIMENSIONS), dtype=np.float32)
+    with INDEXING.time(stage='embed'):
+        start = 0
+        for batch in batchify(chunks, batch_size=64):
+            vectors[start:start + len(batch)] = await get_embeddings([c["text"] for c in batch])
+            start += len(batch)
 
-    ensure_collection()
-    await add_chunks_to_vector_db(chunks)
+    with INDEXING.time(stage='upsert'):
+        await add_chunks_to_vector_db(chunks, vectors)
+    # New chunks can change retrieval results, so cached answers (in every worker) are stale
+    get_answer_cache().invalidate()
+    async with get_redis() as rdb:
+        await add_indexed_doc(rdb, doc_hash, {'doc_name': doc_name, 'doc_id': doc_hash[:8], 'chunks': len(chunks)})
+        await bump_kb_version(rdb)
     return len(chunks)
@@ -0,0 +1,199 @@
+"""Bulk loader: index every PDF under a directory into the knowledge base.
+
+Pipeline (stages connected by bounded queues, so a slow stage applies backpressure):
+
+    extract (process pool) -> chunk -> embed (batches) -> upsert (batches)
+
+Files are identified by content hash. A file is recorded as indexed only once all its
+chunks are upserted, so an interrupted run resumes by skipping recorded files; a file cut
+off mid-way is re-ingested with the same point ids.
+
+    poetry run load                      # indexes settings.EXPORT_DIR
+    poetry run load path/to/docs --workers 8
+"""
+import argparse
+import asyncio
+import hashlib
+import logging
+import multiprocessing
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from app.config import settings
+from app.db import get_redis, get_indexed_docs, add_indexed_doc, bump_kb_version
+from app.embedded_index import IndexLockedError
+from app.embeddings import get_embeddings
+from app.indexing import make_chunks
+from app.utils.pdf import extract_pdf_text
+from app.vector_db import get_vector_store
+
+logger = logging.getLogger(__name__)
+
+_DONE = None  # end-of-stream marker passed between stages
+
+
+def _file_hash(path: Path) -> str:
+    with open(path, 'rb') as f:
+        return hashlib.file_digest(f, 'sha256').hexdigest()
+
+
+class Progress:
+    def __init__(self, total_docs: int):
+        self.total_docs = total_docs
+        self.docs = 0
+        self.chunks = 0
+        self.failed = 0
+        self.start = time.perf_counter()
+
+    def report(self, final=False):
+        elapsed = max(time.perf_counter() - self.start, 1e-9)
+        print(
+            f'{self.docs}/{self.total_docs} docs, {self.chunks} chunks, {self.failed} failed | '
+            f'{self.docs / elapsed:.2f} docs/s, {self.chunks / elapsed:.1f} chunks/s, {elapsed:.0f}s',
+            end='\n' if final else '\r',
+            flush=True,
+        )
+
+
+class BulkLoader:
+    def __init__(self, workers: int, batch_size: int, queue_size: int):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.docs_q = asyncio.Queue(maxsize=queue_size)
+        self.chunks_q = asyncio.Queue(maxsize=queue_size * batch_size)
+        self.batches_q = asyncio.Queue(maxsize=queue_size)
+        self.store = get_vector_store()
+        self.pending: dict[str, dict] = {}  # content hash -> doc record with chunks left to upsert
+        self.progress = None
+
+    async def _extract(self, files: list[tuple[Path, str]]):
+        loop = asyncio.get_running_loop()
+        # spawn: workers must not inherit the parent's embedding model or threads
+        with ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+            slots = asyncio.Semaphore(self.workers * 2)
+
+            async def extract(path, doc_hash):
+                try:
+                    text = await loop.run_in_executor(pool, extract_pdf_text, str(path))
+                except Exception:
+                    logger.exception('Failed to extract %s', path)
+                    self.progress.failed += 1
+                    slots.release()
+                    return
+                # Hold the slot until the text is queued, so a full docs queue stops new extractions
+                try:
+                    await self.docs_q.put((path, doc_hash, text))
+                finally:
+                    slots.release()
+
+            tasks = []
+            for path, doc_hash in files:
+                await slots.acquire()
+                tasks.append(asyncio.create_task(extract(path, doc_hash)))
+            await asyncio.gather(*tasks)
+        await self.docs_q.put(_DONE)
+
+    async def _chunk(self, rdb):
+        while (item := await self.docs_q.get()) is not _DONE:
+            path, doc_hash, text = item
+            doc_name = path.stem or 'document'
+            chunks = make_chunks(text, doc_name, doc_hash)
+            record = {'doc_name': doc_name, 'doc_id': doc_hash[:8], 'chunks': len(chunks)}
+            if not chunks:
+                logger.warning('No text extracted from %s', path)
+                await self._finish_doc(rdb, doc_hash, record)
+                continue
+            self.pending[doc_hash] = {**record, 'left': len(chunks)}
+            for chunk in chunks:
+                await self.chunks_q.put((doc_hash, chunk))
+        await self.chunks_q.put(_DONE)
+
+    async def _embed(self):
+        done = False
+        while not done:
+            batch = []
+            while len(batch) < self.batch_size:
+                item = await self.chunks_q.get()
+                if item is _DONE:
+                    done = True
+                    break
+                batch.append(item)
+            if batch:
+                vectors = await get_embeddings([chunk['text'] for _, chunk in batch])
+                await self.batches_q.put((batch, vectors))
+        await self.batches_q.put(_DONE)
+
+    async def _upsert(self, rdb):
+        while (item := await self.batches_q.get()) is not _DONE:
+            batch, vectors = item
+            await asyncio.to_thread(self.store.upsert, [chunk for _, chunk in batch], vectors)
+            self.progress.chunks += len(batch)
+            for doc_hash, _ in batch:
+                record = self.pending[doc_hash]
+                record['left'] -= 1
+                if not record['left']:
+                    del self.pending[doc_hash]
+                    del record['left']
+                    await self._finish_doc(rdb, doc_hash, record)
+
+    async def _finish_doc(self, rdb, doc_hash, record):
+        await add_indexed_doc(rdb, doc_hash, record)
+        self.progress.docs += 1
+
+    async def _report(self, interval=2.0):
+        while True:
+            await asyncio.sleep(interval)
+            self.progress.report()
+
+    async def run(self, directory: Path, force: bool = False) -> Progress:
+        paths = sorted(p for p in directory.rglob('*') if p.suffix.lower() == '.pdf' and p.is_file())
+        hashes = await asyncio.gather(*(asyncio.to_thread(_file_hash, p) for p in paths))
+        async with get_redis() as rdb:
+            indexed = {} if force else await get_indexed_docs(rdb)
+            files, seen = [], set()
+            for path, doc_hash in zip(paths, hashes):
+                if doc_hash not in indexed and doc_hash not in seen:
+                    files.append((path, doc_hash))
+                    seen.add(doc_hash)
+            print(f'{len(paths)} PDF files in {directory}, {len(paths) - len(files)} already indexed or duplicates, {len(files)} to index')
+            self.progress = Progress(len(files))
+            if not files:
+                return self.progress
+
+            await asyncio.to_thread(self.store.ensure_collection)
+            reporter = asyncio.create_task(self._report())
+            try:
+                await asyncio.gather(
+                    self._extract(files),
+                    self._chunk(rdb),
+                    self._embed(),
+                    self._upsert(rdb),
+                )
+            finally:
+                reporter.cancel()
+                self.progress.report(final=True)
+                if self.progress.docs:
+                    # Lets running API workers drop cached answers built on the old document set
+                    await bump_kb_version(rdb)
+        return self.progress
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('directory', nargs='?', default=settings.EXPORT_DIR, help='Directory searched recursively for PDFs')
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count(), help='Text extraction processes')
+    parser.add_argument('--batch-size', type=int, default=64, help='Chunks per embedding and upsert batch')
+    parser.add_argument('--queue-size', type=int, default=8, help='Max items (docs or batches) buffered between stages')
+    parser.add_argument('--force', action='store_true', help='Re-index files even if their content hash is already recorded')
+    args = parser.parse_args()
+    logging.basicConfig(level=settings.LOG_LEVEL)
+    try:
+        loader = BulkLoader(workers=args.workers, batch_size=args.batch_size, queue_size=args.queue_size)
+    except IndexLockedError as e:
+        sys.exit(str(e))
+    asyncio.run(loader.run(Path(args.directory), force=args.force))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,26 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from app import warmup  # first, so startup time includes importing the app
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
 from app.api import router
 from app.config import settings
+from app.metrics import render_metrics
 
-app = FastAPI()
+logging.basicConfig(level=settings.LOG_LEVEL.upper(), format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+# httpx logs every Ollama request at INFO
+logging.getLogger('httpx').setLevel(logging.WARNING)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Warm up in the background: /health answers immediately, /ready once everything is loaded
+    task = asyncio.create_task(warmup.warm_up())
+    yield
+    task.cancel()
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -18,4 +35,12 @@ app.include_router(router)
 @app.head('/health')
 @app.get('/health')
 def health_check():
-    return 'ok'
\ No newline at end of file
+    return 'ok'
+
+@app.get('/ready')
+def readiness_check():
+    return JSONResponse(warmup.status(), status_code=200 if warmup.is_ready() else 503)
+
+@app.get('/metrics', response_class=PlainTextResponse)
+def metrics():
+    return PlainTextResponse(render_metrics(), media_type='text/plain; version=0.0.4')
@@ -0,0 +1,158 @@
+"""Minimal Prometheus-compatible metrics (text exposition format) and per-request trace spans."""
+import logging
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from time import perf_counter
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+DEPTH_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250)
+
+_registry: list["_Metric"] = []
+_trace: ContextVar[list | None] = ContextVar("trace", default=None)
+
+
+def _format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, description: str):
+        self.name = name
+        self.description = description
+        _registry.append(self)
+
+    def _samples(self) -> list[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.type}"]
+        return "\n".join(lines + self._samples())
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def __init__(self, name: str, description: str):
+        super().__init__(name, description)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self):
+        return [f"{self.name}{_format_labels(k)} {v}" for k, v in self._values.items()]
+
+
+class Gauge(_Metric):
+    """Gauge read from a callback at scrape time."""
+    type = "gauge"
+
+    def __init__(self, name: str, description: str, callback):
+        super().__init__(name, description)
+        self.callback = callback
+
+    def _samples(self):
+        return [f"{self.name} {self.callback()}"]
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, description: str, buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, description)
+        self.buckets = buckets
+        self._series: dict[tuple, list] = {}  # labels -> [bucket counts..., sum, count]
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [0] * (len(self.buckets) + 2)
+        i = bisect_left(self.buckets, value)
+        if i < len(self.buckets):
+            series[i] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = perf_counter() - start
+            self.observe(elapsed, **labels)
+            _record_span(self.name, elapsed, labels)
+
+    def timed(self, **labels):
+        """Decorator timing an async function."""
+        def decorator(fn):
+            @wraps(fn)
+            async def wrapper(*args, **kwargs):
+                with self.time(**labels):
+                    return await fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def _samples(self):
+        lines = []
+        for key, series in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(key + (('le', bound),))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(key + (('le', '+Inf'),))} {series[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {series[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {series[-1]}")
+        return lines
+
+
+def render_metrics() -> str:
+    return "\n".join(m.render() for m in _registry) + "\n"
+
+
+# TRACING
+def start_trace():
+    """Start collecting spans for the current task (no-op unless TRACE_REQUESTS is enabled)."""
+    if settings.TRACE_REQUESTS:
+        _trace.set([])
+
+
+def _record_span(name: str, elapsed: float, labels: dict):
+    spans = _trace.get()
+    if spans is not None:
+        spans.append((name, labels, elapsed))
+
+
+def end_trace(label: str):
+    spans = _trace.get()
+    if spans is None:
+        return
+    _trace.set(None)
+    summary = ", ".join(
+        f"{name}{_format_labels(tuple(sorted(labels.items())))}={elapsed * 1000:.1f}ms" for name, labels, elapsed in spans
+    )
+    logger.info("trace %s: %s", label, summary)
+
+
+# METRICS
+LLM_TTFT = Histogram("llm_time_to_first_token_seconds", "Time from sending a chat request to Ollama until the first streamed chunk")
+LLM_GENERATION = Histogram("llm_generation_seconds", "Total time of an Ollama chat generation")
+LLM_QUEUE_WAIT = Histogram("llm_queue_wait_seconds", "Time spent waiting for an admission slot before calling Ollama")
+EMBEDDING = Histogram("embedding_seconds", "Time to embed texts with the sentence-transformers model")
+VECTOR_SEARCH = Histogram("vector_search_seconds", "Time of a Qdrant vector search")
+VECTOR_FETCH = Histogram("vector_fetch_seconds", "Time to fetch chunk texts for packed search hits")
+REDIS = Histogram("redis_seconds", "Time of chat persistence operations against Redis")
+INDEXING = Histogram("indexing_stage_seconds", "Time per PDF ingestion stage (extract, chunk, embed, upsert)")
+SSE_QUEUE_DEPTH = Histogram("sse_queue_depth", "Pending events in a chat's SSE queue when a new event is sent", buckets=DEPTH_BUCKETS)
+ANSWER_CACHE = Counter("answer_cache_requests_total", "Semantic answer cache lookups by result")
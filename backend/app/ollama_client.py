@@ -1,12 +1,275 @@
 """Ollama chat client with streaming and tool-calling support, compatible with the RAG assistant."""
+import asyncio
 import json
+import logging
+from collections import OrderedDict, deque
+from functools import cache
+from time import monotonic, perf_counter
 from uuid import uuid4
-from ollama import AsyncClient
+import httpx
+from ollama import AsyncClient, ResponseError
+from pydantic import ValidationError
 from app.config import settings
 from app.assistants.tools import QueryKnowledgeBaseTool
+from app.metrics import Gauge, LLM_TTFT, LLM_GENERATION, LLM_QUEUE_WAIT
 
+logger = logging.getLogger(__name__)
 
-def _tool_schema_from_pydantic():
+
+# Admission priorities (lower is served first): second-pass RAG answers finish a turn,
+# so they go ahead of first-pass decisions that start new work.
+PRIORITY_ANSWER = 0
+PRIORITY_DECISION = 1
+
+
+class QueueTimeoutError(Exception):
+    """Raised when a generation waits longer than OLLAMA_QUEUE_TIMEOUT for a free slot."""
+
+
+class AdmissionScheduler:
+    """Limit concurrent Ollama generations, admitting waiters by priority and round-robin across chats."""
+
+    def __init__(self, max_concurrent: int, queue_timeout: float | None = None):
+        self.max_concurrent = max_concurrent
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        # priority -> chat_id -> waiting futures (chat order rotates for fairness)
+        self._queues: dict[int, OrderedDict[str, deque]] = {}
+        self._waiting = 0
+        self._admitted = 0
+        self._timeouts = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    @property
+    def queue_depth(self) -> int:
+        return self._waiting
+
+    def stats(self) -> dict:
+        return {
+            "active": self.active,
+            "max_concurrent": self.max_concurrent,
+            "queue_depth": self._waiting,
+            "admitted": self._admitted,
+            "timeouts": self._timeouts,
+            "avg_wait_seconds": self._wait_total / self._admitted if self._admitted else 0.0,
+            "max_wait_seconds": self._wait_max,
+        }
+
+    def _enqueue(self, chat_id: str, priority: int, fut: asyncio.Future):
+        chats = self._queues.setdefault(priority, OrderedDict())
+        chats.setdefault(chat_id, deque()).append(fut)
+        self._waiting += 1
+
+    def _remove(self, chat_id: str, priority: int, fut: asyncio.Future):
+        chats = self._queues.get(priority)
+        waiters = chats.get(chat_id) if chats else None
+        if waiters and fut in waiters:
+            waiters.remove(fut)
+            self._waiting -= 1
+            if not waiters:
+                del chats[chat_id]
+
+    def _admit_next(self):
+        while self.active < self.max_concurrent and self._waiting:
+            priority = min(p for p, chats in self._queues.items() if chats)
+            chats = self._queues[priority]
+            chat_id, waiters = next(iter(chats.items()))
+            fut = waiters.popleft()
+            self._waiting -= 1
+            if waiters:
+                chats.move_to_end(chat_id)
+            else:
+                del chats[chat_id]
+            if fut.done():
+                continue
+            self.active += 1
+            fut.set_result(None)
+
+    def _record_wait(self, started: float):
+        waited = monotonic() - started
+        LLM_QUEUE_WAIT.observe(waited)
+        self._admitted += 1
+        self._wait_total += waited
+        self._wait_max = max(self._wait_max, waited)
+
+    async def acquire(self, chat_id: str | None = None, priority: int = PRIORITY_DECISION):
+        started = monotonic()
+        if self.active < self.max_concurrent and not self._waiting:
+            self.active += 1
+            self._record_wait(started)
+            return
+        chat_id = chat_id or str(uuid4())
+        fut = asyncio.get_running_loop().create_future()
+        self._enqueue(chat_id, priority, fut)
+        try:
+            done, _ = await asyncio.wait([fut], timeout=self.queue_timeout)
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                self.release()
+            else:
+                self._remove(chat_id, priority, fut)
+                fut.cancel()
+            raise
+        if not done:
+            self._remove(chat_id, priority, fut)
+            fut.cancel()
+            self._timeouts += 1
+            raise QueueTimeoutError(f"Timed out after {self.queue_timeout}s waiting for a free generation slot")
+        self._record_wait(started)
+
+    def release(self):
+        self.active -= 1
+        self._admit_next()
+
+
+_scheduler: AdmissionScheduler | None = None
+
+
+def get_scheduler() -> AdmissionScheduler:
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = AdmissionScheduler(
+            max_concurrent=settings.OLLAMA_MAX_CONCURRENT,
+            queue_timeout=settings.OLLAMA_QUEUE_TIMEOUT,
+        )
+    return _scheduler
+
+
+Gauge("llm_queue_depth", "Generations waiting for an admission slot", lambda: get_scheduler().queue_depth)
+Gauge("llm_active_generations", "Generations currently running against Ollama", lambda: get_scheduler().active)
+
+
+class OllamaBackend:
+    def __init__(self, host: str):
+        self.host = host
+        self.client = AsyncClient(host=host)
+        self.outstanding = 0
+        self.healthy = True
+        self.failures = 0
+        self.next_probe = 0.0
+        self.probing = False
+
+    def stats(self) -> dict:
+        return {"host": self.host, "healthy": self.healthy, "outstanding": self.outstanding, "failures": self.failures}
+
+
+class OllamaPool:
+    """Balance generations across Ollama endpoints.
+
+    Requests go to the healthy backend with the fewest outstanding requests, except that a chat
+    sticks to the backend that served it before (so Ollama can reuse its cached prompt prefix)
+    unless that backend is down or more than OLLAMA_STICKY_SLACK requests busier than the least
+    loaded one. Backends are ejected after OLLAMA_MAX_FAILURES consecutive failures and probed
+    every OLLAMA_PROBE_INTERVAL seconds until they answer again.
+    """
+
+    def __init__(self, hosts: list[str], max_failures: int = 2, probe_interval: float = 10.0,
+                 sticky_slack: int = 2, max_sticky_chats: int = 10000):
+        self.backends = [OllamaBackend(host) for host in hosts]
+        self.max_failures = max_failures
+        self.probe_interval = probe_interval
+        self.sticky_slack = sticky_slack
+        self.max_sticky_chats = max_sticky_chats
+        self._sticky: OrderedDict[str, OllamaBackend] = OrderedDict()
+        # The event loop only keeps weak references to tasks; hold running probes until they finish
+        self._probes: set[asyncio.Task] = set()
+
+    def stats(self) -> list[dict]:
+        return [b.stats() for b in self.backends]
+
+    def acquire(self, chat_id: str | None = None, exclude: set | None = None) -> OllamaBackend | None:
+        candidates = [b for b in self.backends if b not in (exclude or ())]
+        self._schedule_probes()
+        healthy = [b for b in candidates if b.healthy]
+        if not healthy:
+            # Everything is down: try the backend that failed longest ago rather than refusing outright
+            if not candidates:
+                return None
+            backend = min(candidates, key=lambda b: b.next_probe)
+        else:
+            backend = min(healthy, key=lambda b: b.outstanding)
+            sticky = self._sticky.get(chat_id) if chat_id else None
+            if sticky in healthy and sticky.outstanding <= backend.outstanding + self.sticky_slack:
+                backend = sticky
+        if chat_id:
+            self._sticky[chat_id] = backend
+            self._sticky.move_to_end(chat_id)
+            while len(self._sticky) > self.max_sticky_chats:
+                self._sticky.popitem(last=False)
+        backend.outstanding += 1
+        return backend
+
+    def release(self, backend: OllamaBackend, ok: bool = True):
+        backend.outstanding -= 1
+        if ok:
+            backend.failures = 0
+            backend.healthy = True
+            return
+        backend.failures += 1
+        if backend.failures >= self.max_failures and backend.healthy:
+            logger.warning("Ejecting Ollama backend %s after %d consecutive failures", backend.host, backend.failures)
+            self.eject(backend)
+
+    def eject(self, backend: OllamaBackend):
+        """Stop routing to a backend until a probe finds it up again."""
+        backend.healthy = False
+        backend.next_probe = monotonic() + self.probe_interval
+
+    def _schedule_probes(self):
+        now = monotonic()
+        for backend in self.backends:
+            if not backend.healthy and not backend.probing and now >= backend.next_probe:
+                backend.probing = True
+                task = asyncio.get_running_loop().create_task(self._probe(backend))
+                self._probes.add(task)
+                task.add_done_callback(self._probes.discard)
+
+    async def _probe(self, backend: OllamaBackend):
+        try:
+            await asyncio.wait_for(backend.client.list(), timeout=self.probe_interval)
+            backend.healthy = True
+            backend.failures = 0
+            logger.info("Ollama backend %s is healthy again", backend.host)
+        except Exception:
+            backend.next_probe = monotonic() + self.probe_interval
+        finally:
+            backend.probing = False
+
+
+def _is_backend_failure(e: Exception) -> bool:
+    """Connection problems and server errors count against a backend; request errors (e.g. unknown model) don't."""
+    if isinstance(e, (httpx.TransportError, ConnectionError)):
+        return True
+    return isinstance(e, ResponseError) and e.status_code >= 500
+
+
+_pool: OllamaPool | None = None
+
+
+def get_pool() -> OllamaPool:
+    global _pool
+    if _pool is None:
+        _pool = OllamaPool(
+            hosts=settings.ollama_hosts,
+            max_failures=settings.OLLAMA_MAX_FAILURES,
+            probe_interval=settings.OLLAMA_PROBE_INTERVAL,
+            sticky_slack=settings.OLLAMA_STICKY_SLACK,
+        )
+    return _pool
+
+
+def _ollama_property(spec: dict) -> dict:
+    """A pydantic JSON schema property with one concrete type (Optional[...] unwrapped), as Ollama expects."""
+    variants = [v for v in spec.get("anyOf", [spec]) if v.get("type") != "null"]
+    prop = {k: v for k, v in (variants[0] if variants else {}).items() if k in ("type", "items", "enum")}
+    prop.setdefault("type", "string")
+    prop["description"] = spec.get("description") or ""
+    return prop
+
+
+@cache
+def tool_schema_from_pydantic():
     """Build Ollama tools list from QueryKnowledgeBaseTool."""
     schema = QueryKnowledgeBaseTool.model_json_schema()
     props = schema.get("properties", {})
@@ -19,13 +282,7 @@ def _tool_schema_from_pydantic():
                 "description": f"{tool_desc}\n\nIMPORTANT: You MUST call this tool for ANY question about document content, facts, summaries, or information from indexed documents. Extract 2-5 key search terms from the user's question and use them as query_input.",
                 "parameters": {
                     "type": "object",
-                    "properties": {
-                        k: {
-                            "type": "string",
-                            "description": (v.get("description") or "")
-                        }
-                        for k, v in props.items()
-                    },
+                    "properties": {k: _ollama_property(v) for k, v in props.items()},
                     "required": schema.get("required", ["query_input"]),
                 },
             },
@@ -81,6 +338,13 @@ class _DeltaEvent:
         self.delta = delta
 
 
+class _ToolCallEvent:
+    """Emitted as soon as Ollama streams a tool call, before the generation finishes."""
+    type = "tool_call"
+    def __init__(self, tool_call: "_MockToolCall"):
+        self.tool_call = tool_call
+
+
 class _MockMessage:
     def __init__(self, content: str, tool_calls: list | None = None):
         self.content = content or ""
@@ -100,12 +364,13 @@ class _MockChoice:
 class _OllamaStreamContext:
     """Context manager that runs Ollama stream and provides get_final_completion()."""
 
-    def __init__(self, messages: list[dict], tools: list | None = None):
-        self._client = AsyncClient(host=settings.OLLAMA_HOST)
+    def __init__(self, messages: list[dict], tools: bool = False, chat_id: str | None = None):
+        self._pool = get_pool()
+        self._chat_id = chat_id
         self._messages = messages
-        self._tools = _tool_schema_from_pydantic()
+        self._tools = tool_schema_from_pydantic() if tools else []
         self._content: list[str] = []
-        self._tool_calls_accum: list[dict] = []
+        self._tool_calls: list[_MockToolCall] = []
         self._final_message: _MockMessage | None = None
 
     async def __aenter__(self):
@@ -116,94 +381,103 @@ class _OllamaStreamContext:
 
     async def _run_stream(self):
         ollama_messages = _openai_to_ollama_messages(self._messages)
-        print(f"\n[Ollama] Sending request with {len(self._tools)} tool(s):")
-        for tool in self._tools:
-            fn = tool.get("function", {})
-            print(f"  - Tool: {fn.get('name', 'unknown')}")
-            print(f"    Description: {fn.get('description', '')[:100]}...")
-            print(f"    Parameters: {list(fn.get('parameters', {}).get('properties', {}).keys())}")
-        
         # Try to encourage tool usage - some Ollama models support tool_choice
         chat_kwargs = {
             "model": settings.OLLAMA_MODEL,
             "messages": ollama_messages,
             "tools": self._tools,
             "stream": True,
-            "think": False
+            "think": False,
+            "options": {"num_ctx": settings.OLLAMA_CONTEXT_LENGTH},
+            "keep_alive": settings.OLLAMA_KEEP_ALIVE,
         }
         # Some models support tool_choice='required' or tool_choice={'type': 'function', 'function': {'name': 'QueryKnowledgeBaseTool'}}
         # But not all models support it, so we'll try without first
-        
-        stream = await self._client.chat(**chat_kwargs)
-        tool_calls_received = False
-        async for chunk in stream:
+
+        logger.debug("Sending chat request with %d message(s) and %d tool(s)", len(ollama_messages), len(self._tools))
+        start = perf_counter()
+        first_chunk = True
+        async for chunk in self._stream_from_pool(chat_kwargs):
+            if first_chunk:
+                LLM_TTFT.observe(perf_counter() - start)
+                first_chunk = False
             if chunk.message.content:
                 self._content.append(chunk.message.content)
                 yield _DeltaEvent(chunk.message.content)
             if getattr(chunk.message, "tool_calls", None):
-                tool_calls_received = True
-                print(f"\n[Ollama] Received tool_calls in chunk: {len(chunk.message.tool_calls)}")
+                logger.debug("Received %d tool call(s) in chunk", len(chunk.message.tool_calls))
                 for tc in chunk.message.tool_calls:
-                    print(f"  - Tool call type: {type(tc)}")
-                    print(f"    Has 'function': {hasattr(tc, 'function')}")
-                    if hasattr(tc, 'function'):
-                        fn = tc.function
-                        print(f"    Function name: {getattr(fn, 'name', 'N/A')}")
-                        print(f"    Function arguments: {getattr(fn, 'arguments', 'N/A')}")
-                    self._tool_calls_accum.append(tc)
-        
-        if not tool_calls_received and self._tool_calls_accum:
-            print(f"[Ollama] Accumulated {len(self._tool_calls_accum)} tool call(s) from stream")
-        elif not tool_calls_received:
-            print(f"[Ollama] No tool calls received in stream")
+                    tool_call = _parse_tool_call(tc)
+                    self._tool_calls.append(tool_call)
+                    yield _ToolCallEvent(tool_call)
+        LLM_GENERATION.observe(perf_counter() - start)
+
+    async def _stream_from_pool(self, chat_kwargs):
+        """Stream chunks from a pool backend, failing over to another one if it breaks before the first chunk."""
+        tried = set()
+        while True:
+            backend = self._pool.acquire(self._chat_id, exclude=tried)
+            if backend is None:
+                raise ConnectionError("No Ollama backend available")
+            tried.add(backend)
+            started = False
+            ok = True
+            try:
+                stream = await backend.client.chat(**chat_kwargs)
+                async for chunk in stream:
+                    started = True
+                    yield chunk
+                return
+            except Exception as e:
+                ok = not _is_backend_failure(e)
+                if ok or started or len(tried) == len(self._pool.backends):
+                    raise
+            finally:
+                self._pool.release(backend, ok=ok)
 
     def build_final_completion(self):
         """Build final message with content and tool_calls (OpenAI-style) for the assistant."""
         content = "".join(self._content)
-        tool_calls = []
-        print(f"\n[Ollama] Building final completion from {len(self._tool_calls_accum)} accumulated tool call(s)")
-        for i, tc in enumerate(self._tool_calls_accum, 1):
-            print(f"  Processing tool call {i}: type={type(tc)}")
-            # Handle both Ollama's native tool call objects and dicts
-            if hasattr(tc, "function"):
-                # Real Ollama tool call object
-                fn = tc.function
-                name = getattr(fn, "name", None)
-                args = getattr(fn, "arguments", None)
-                print(f"    ✓ Real Ollama tool call: {name}")
-            elif isinstance(tc, dict):
-                # Dict format
-                fn = tc.get("function", tc)
-                name = fn.get("name") if isinstance(fn, dict) else "QueryKnowledgeBaseTool"
-                args = fn.get("arguments", {}) if isinstance(fn, dict) else {}
-                print(f"    ✓ Dict format tool call: {name}")
-            else:
-                # Fallback
-                name = "QueryKnowledgeBaseTool"
-                args = {}
-                print(f"    ⚠ Unknown format, using defaults")
-            
-            if isinstance(args, str):
-                try:
-                    args = json.loads(args)
-                except json.JSONDecodeError:
-                    args = {}
-            
-            print(f"    Arguments: {args}")
-            try:
-                parsed = QueryKnowledgeBaseTool.model_validate(args)
-                print(f"    ✓ Successfully parsed as QueryKnowledgeBaseTool")
-            except Exception as e:
-                print(f"    ⚠ Parse error: {e}, using fallback")
-                parsed = QueryKnowledgeBaseTool(query_input=args.get("query_input", ""))
-            
-            mock_tc = _MockToolCall(id=str(uuid4()), name=name, arguments=args, parsed_arguments=parsed)
-            tool_calls.append(mock_tc)
-        
-        self._final_message = _MockMessage(content=content, tool_calls=tool_calls)
+        self._final_message = _MockMessage(content=content, tool_calls=list(self._tool_calls))
         return _MockCompletion(self._final_message)
 
 
+def _parse_tool_call(tc) -> "_MockToolCall":
+    """Convert a streamed Ollama tool call (object or dict) into an OpenAI-style tool call with parsed arguments."""
+    # Handle both Ollama's native tool call objects and dicts
+    if hasattr(tc, "function"):
+        fn = tc.function
+        name = getattr(fn, "name", None)
+        args = getattr(fn, "arguments", None)
+    elif isinstance(tc, dict):
+        fn = tc.get("function", tc)
+        name = fn.get("name") if isinstance(fn, dict) else "QueryKnowledgeBaseTool"
+        args = fn.get("arguments", {}) if isinstance(fn, dict) else {}
+    else:
+        logger.warning("Unknown tool call format %s, using defaults", type(tc).__name__)
+        name = "QueryKnowledgeBaseTool"
+        args = {}
+
+    if isinstance(args, str):
+        try:
+            args = json.loads(args)
+        except json.JSONDecodeError:
+            args = {}
+    args = args or {}
+
+    try:
+        parsed = QueryKnowledgeBaseTool.model_validate(args)
+    except ValidationError as e:
+        # Keep the fields that are valid: a malformed optional filter shouldn't cost the query (or vice versa)
+        invalid = {err["loc"][0] for err in e.errors() if err["loc"]}
+        logger.warning("Could not parse %s arguments %s (%s), dropping %s", name, args, e, sorted(invalid))
+        valid = {k: v for k, v in args.items() if k not in invalid}
+        valid.setdefault("query_input", str(args.get("query_input") or ""))
+        parsed = QueryKnowledgeBaseTool.model_validate(valid)
+    logger.debug("Tool call %s(%s)", name, args)
+    return _MockToolCall(id=str(uuid4()), name=name, arguments=args, parsed_arguments=parsed)
+
+
 class _MockToolCall:
     def __init__(self, id: str, name: str, arguments: dict, parsed_arguments: QueryKnowledgeBaseTool):
         self.id = id
@@ -217,20 +491,32 @@ class _MockFunction:
         self.parsed_arguments = parsed_arguments
 
 
-def chat_stream(messages: list[dict], tools: list | None = None, **kwargs):
+def chat_stream(messages: list[dict], tools: bool = False, chat_id: str | None = None, priority: int = PRIORITY_DECISION, **kwargs):
     """
     Returns an async context manager that streams Ollama chat and provides get_final_completion().
-    Compatible with the RAG assistant's expected interface.
+    Compatible with the RAG assistant's expected interface. With tools=True the model is
+    offered QueryKnowledgeBaseTool (schema from tool_schema_from_pydantic()).
+    Entering the context waits for a generation slot from the admission scheduler
+    (raises QueueTimeoutError if none frees up in time).
     """
-    ctx = _OllamaStreamContext(messages, tools=tools)
+    ctx = _OllamaStreamContext(messages, tools=tools, chat_id=chat_id)
+    scheduler = get_scheduler()
 
     class _StreamAdapter:
         async def __aenter__(self):
-            await ctx.__aenter__()
+            await scheduler.acquire(chat_id, priority)
+            try:
+                await ctx.__aenter__()
+            except BaseException:
+                scheduler.release()
+                raise
             return self
 
         async def __aexit__(self, *args):
-            return await ctx.__aexit__(*args)
+            try:
+                return await ctx.__aexit__(*args)
+            finally:
+                scheduler.release()
 
         def __aiter__(self):
             return self
@@ -0,0 +1,113 @@
+"""Multi-worker API server with model memory shared between workers.
+
+The master process imports the app and loads the embedding model weights and tokenizer,
+then forks the workers. Workers share those pages copy-on-write, so each extra worker
+adds only its own working memory instead of another model copy. Weights are loaded but
+never run in the master: every worker runs inference (and its startup warm-up) itself,
+with torch limited to its share of the CPU cores.
+
+    python -m app.serve --workers 4 --port 8000
+
+Workers share one listening socket; the master restarts any worker that dies.
+Limits such as OLLAMA_MAX_CONCURRENT and caches like the answer cache are per worker.
+With a single worker nothing is preloaded: the server starts at once and loads the model
+in its startup warm-up. Several workers need Qdrant: the embedded vector store is a
+single-process index, so VECTOR_STORE=embedded is rejected when workers > 1.
+"""
+import argparse
+import gc
+import logging
+import os
+import signal
+import time
+import uvicorn
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def preload():
+    """Import the app and load shared read-only state before forking."""
+    from app.main import app
+    from app.embeddings import load_model
+    from app.tokenizer import get_tokenizer
+    load_model()
+    get_tokenizer()
+    # Keep the garbage collector from touching (and so copying) everything loaded so far
+    gc.freeze()
+    return app
+
+
+def _run_worker(config: uvicorn.Config, sock, threads: int):
+    from app.embeddings import set_num_threads
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    if threads:
+        set_num_threads(threads)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def _supervise(spawn, workers: int):
+    pids = {spawn(): i for i in range(workers)}
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in pids:
+            os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    while pids:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        worker = pids.pop(pid, None)
+        if worker is not None and not stopping:
+            logger.warning("Worker %d (pid %d) exited with status %d, restarting", worker, pid, os.waitstatus_to_exitcode(status))
+            time.sleep(1)  # don't spin if workers fail at startup
+            pids[spawn()] = worker
+
+
+def serve(host: str, port: int, workers: int):
+    if workers <= 1:
+        # Nothing to share: load the model in the warm-up, so /health answers right away
+        uvicorn.Server(uvicorn.Config('app.main:app', host=host, port=port, log_level=settings.LOG_LEVEL.lower())).run()
+        return
+    if settings.VECTOR_STORE == 'embedded':
+        raise SystemExit("VECTOR_STORE=embedded supports a single worker only; use Qdrant with --workers > 1")
+    app = preload()
+    config = uvicorn.Config(app, host=host, port=port, log_level=settings.LOG_LEVEL.lower())
+    threads = settings.EMBEDDING_THREADS or max(1, (os.cpu_count() or 1) // workers)
+    sock = config.bind_socket()
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                _run_worker(config, sock, threads)
+                code = 0
+            except BaseException:
+                logger.exception("Worker %d crashed", os.getpid())
+            finally:
+                os._exit(code)
+        return pid
+
+    logger.info("Starting %d workers on %s:%d (%d embedding thread(s) each)", workers, host, port, threads)
+    _supervise(spawn, workers)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=settings.WEB_CONCURRENCY)
+    args = parser.parse_args()
+    serve(args.host, args.port, args.workers)
+
+
+if __name__ == '__main__':
+    main()
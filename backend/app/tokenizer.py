@@ -1,6 +1,10 @@
-import tiktoken
+from functools import cache
 
-tokenizer = tiktoken.get_encoding('o200k_base')
+@cache
+def get_tokenizer():
+    # Imported and loaded on first use: building the o200k_base encoding takes a noticeable part of startup
+    import tiktoken
+    return tiktoken.get_encoding('o200k_base')
 
 def token_size(text):
-    return len(tokenizer.encode(text))
+    return len(get_tokenizer().encode(text))
@@ -0,0 +1,11 @@
+"""PDF text extraction, kept free of heavy imports so it can run in worker processes."""
+from io import BytesIO
+from pathlib import Path
+
+
+def extract_pdf_text(source: bytes | str | Path) -> str:
+    """Extract the text of a PDF given as bytes or a file path."""
+    from pdfminer.high_level import extract_text
+    if isinstance(source, bytes):
+        source = BytesIO(source)
+    return extract_text(source)
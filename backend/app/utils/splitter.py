@@ -1,7 +1,6 @@
 # Inspired by LlamaIndex's Sentence Splitter
 # https://github.com/run-llama/llama_index/blob/main/llama-index-core/llama_index/core/node_parser/text/sentence.py
-import nltk
-from functools import partial
+from functools import cache, partial
 from app.tokenizer import token_size
 
 
@@ -29,7 +28,11 @@ class FixedSizeCharSplitter:
     def __call__(self, text: str) -> list[str]:
         return self.split(text)
 
-sentence_tokenizer = nltk.tokenize.PunktSentenceTokenizer()
+@cache
+def sentence_tokenizer():
+    # nltk is slow to import and only needed by TextSplitter
+    import nltk
+    return nltk.tokenize.PunktSentenceTokenizer()
 
 def split_by_separator(text, sep):
     splits = text.split(sep)
@@ -39,7 +42,7 @@ def split_by_separator(text, sep):
     return res
 
 def split_sentences(text):
-    spans = [s[0] for s in sentence_tokenizer.span_tokenize(text)] + [len(text)]
+    spans = [s[0] for s in sentence_tokenizer().span_tokenize(text)] + [len(text)]
     return [text[spans[i]:spans[i+1]] for i in range(len(spans) - 1)]
 
 
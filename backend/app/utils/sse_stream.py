@@ -1,5 +1,6 @@
 import asyncio
 from sse_starlette import ServerSentEvent
+from app.metrics import SSE_QUEUE_DEPTH
 
 class SSEStream:
     def __init__(self) -> None:
@@ -13,10 +14,16 @@ class SSEStream:
         data = await self._queue.get()
         if data is self._stream_end:
             raise StopAsyncIteration
+        if isinstance(data, ServerSentEvent):
+            return data
         return ServerSentEvent(data=data)
 
     async def send(self, data):
+        SSE_QUEUE_DEPTH.observe(self._queue.qsize())
         await self._queue.put(data)
 
+    async def send_error(self, message):
+        await self._queue.put(ServerSentEvent(data=message, event='error'))
+
     async def close(self):
         await self._queue.put(self._stream_end)
@@ -1,71 +1,270 @@
-"""Qdrant vector database for document knowledge base."""
+"""Vector store for the document knowledge base: Qdrant (default) or an embedded in-process index."""
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+import numpy as np
 from qdrant_client import QdrantClient
-from qdrant_client.models import Distance, VectorParams, PointStruct
+from qdrant_client.models import (
+    BinaryQuantization,
+    BinaryQuantizationConfig,
+    Distance,
+    FieldCondition,
+    Filter,
+    KeywordIndexParams,
+    KeywordIndexType,
+    MatchAny,
+    PayloadSchemaType,
+    QuantizationSearchParams,
+    ScalarQuantization,
+    ScalarQuantizationConfig,
+    ScalarType,
+    SearchParams,
+    VectorParams,
+)
 from app.config import settings
+from app.embedded_index import EmbeddedVectorIndex
+from app.metrics import VECTOR_FETCH, VECTOR_SEARCH
+
+logger = logging.getLogger(__name__)
+
+# Payload fields returned by a lazy-text search; text is fetched later for the packed hits only
+SLIM_PAYLOAD = ["chunk_id", "doc_name", "tokens"]
+# Indexed payload fields; a keyword index lets Qdrant's HNSW search apply doc filters during traversal
+PAYLOAD_INDEXES = {
+    "doc_name": KeywordIndexParams(type=KeywordIndexType.KEYWORD, is_tenant=True),
+    "doc_id": PayloadSchemaType.KEYWORD,
+    "uploaded_at": PayloadSchemaType.INTEGER,
+}
 
 _client: QdrantClient | None = None
+_store: "QdrantVectorStore | EmbeddedVectorStore | None" = None
 
 
 def get_qdrant() -> QdrantClient:
     global _client
     if _client is None:
-        _client = QdrantClient(url=settings.QDRANT_URL, prefer_grpc=settings.QDRANT_GRPC)
+        if settings.QDRANT_URL == ':memory:':
+            # Local in-process mode (tests and benchmarks), no Qdrant server needed
+            _client = QdrantClient(location=':memory:')
+        else:
+            _client = QdrantClient(url=settings.QDRANT_URL, prefer_grpc=settings.QDRANT_GRPC)
     return _client
 
 
-def ensure_collection(client: QdrantClient | None = None):
-    """Create the collection if it does not exist."""
-    c = client or get_qdrant()
-    collections = c.get_collections().collections
-    names = [col.name for col in collections]
-    if settings.QDRANT_COLLECTION not in names:
-        c.create_collection(
-            collection_name=settings.QDRANT_COLLECTION,
-            vectors_config=VectorParams(
-                size=settings.EMBEDDING_DIMENSIONS,
-                distance=Distance.COSINE,
-            ),
+def get_vector_store() -> "QdrantVectorStore | EmbeddedVectorStore":
+    """Return the store selected by settings.VECTOR_STORE ('qdrant' or 'embedded')."""
+    global _store
+    if _store is None:
+        if settings.VECTOR_STORE == 'embedded':
+            _store = EmbeddedVectorStore(settings.EMBEDDED_INDEX_PATH)
+        elif settings.VECTOR_STORE == 'qdrant':
+            _store = QdrantVectorStore(get_qdrant())
+        else:
+            raise ValueError(f"Unknown VECTOR_STORE '{settings.VECTOR_STORE}' (expected 'qdrant' or 'embedded')")
+    return _store
+
+
+def _chunk_payload(chunk: dict) -> dict:
+    return {
+        "chunk_id": chunk["chunk_id"],
+        "text": chunk["text"],
+        "tokens": chunk.get("tokens"),
+        "doc_name": chunk["doc_name"],
+        "doc_id": chunk.get("doc_id"),
+        "uploaded_at": chunk.get("uploaded_at"),
+    }
+
+
+def _hit(score: float, payload: dict | None, point_id, with_text: bool = True) -> dict:
+    """Search hit dict; text is None when it was not fetched with the search."""
+    payload = payload or {}
+    return {
+        "id": str(point_id),
+        "score": score,
+        "chunk_id": payload.get("chunk_id", str(point_id)),
+        "text": payload.get("text", "") if with_text else None,
+        "tokens": payload.get("tokens"),
+        "doc_name": payload.get("doc_name", ""),
+    }
+
+
+def _quantization_config():
+    mode = settings.QDRANT_QUANTIZATION
+    if mode == 'scalar':
+        return ScalarQuantization(scalar=ScalarQuantizationConfig(type=ScalarType.INT8, quantile=0.99, always_ram=True))
+    if mode == 'binary':
+        return BinaryQuantization(binary=BinaryQuantizationConfig(always_ram=True))
+    if mode != 'none':
+        raise ValueError(f"Unknown QDRANT_QUANTIZATION '{mode}' (expected 'none', 'scalar' or 'binary')")
+    return None
+
+
+class QdrantVectorStore:
+    def __init__(self, client: QdrantClient, collection: str | None = None):
+        self.client = client
+        self.collection = collection or settings.QDRANT_COLLECTION
+        self._texts: OrderedDict[str, str] = OrderedDict()  # point id -> chunk text (LRU)
+        self._texts_lock = threading.Lock()  # searches run in worker threads
+        self._indexed = False
+
+    def ensure_collection(self):
+        """Create the collection and its payload indexes if they do not exist.
+        Quantization settings apply only when the collection is created.
+        """
+        if self._indexed:
+            return
+        if not self.client.collection_exists(self.collection):
+            self.client.create_collection(
+                collection_name=self.collection,
+                vectors_config=VectorParams(
+                    size=settings.EMBEDDING_DIMENSIONS,
+                    distance=Distance.COSINE,
+                    on_disk=settings.QDRANT_ON_DISK_VECTORS,
+                ),
+                quantization_config=_quantization_config(),
+            )
+        existing = self.client.get_collection(self.collection).payload_schema
+        for field, schema in PAYLOAD_INDEXES.items():
+            if field not in existing:
+                self.client.create_payload_index(self.collection, field_name=field, field_schema=schema, wait=True)
+        self._indexed = True
+
+    def upsert(self, chunks: list[dict], vectors: np.ndarray) -> None:
+        # upload_collection slices the array into request batches, so no per-point objects are built up front
+        self.client.upload_collection(
+            collection_name=self.collection,
+            vectors=vectors,
+            payload=[_chunk_payload(chunk) for chunk in chunks],
+            ids=[chunk["id"] for chunk in chunks],
+            batch_size=settings.UPSERT_BATCH_SIZE,
+            wait=True,
         )
 
+    def search(self, query_vector, top_k: int, doc_names: list[str] | None = None) -> list[dict]:
+        lazy = settings.QDRANT_LAZY_TEXT
+        query_filter = None
+        if doc_names:
+            query_filter = Filter(must=[FieldCondition(key="doc_name", match=MatchAny(any=list(doc_names)))])
+        search_params = None
+        if settings.QDRANT_QUANTIZATION != 'none':
+            search_params = SearchParams(quantization=QuantizationSearchParams(
+                rescore=settings.QDRANT_RESCORE,
+                oversampling=settings.QDRANT_OVERSAMPLING,
+            ))
+        response = self.client.query_points(
+            collection_name=self.collection,
+            query=query_vector,
+            limit=top_k,
+            query_filter=query_filter,
+            search_params=search_params,
+            with_payload=SLIM_PAYLOAD if lazy else True,
+        )
+        hits = [_hit(hit.score, hit.payload, hit.id, with_text=not lazy) for hit in response.points]
+        with self._texts_lock:
+            for hit in hits:
+                if hit["text"] is None and hit["id"] in self._texts:
+                    hit["text"] = self._texts[hit["id"]]
+                    self._texts.move_to_end(hit["id"])
+        return hits
+
+    def fetch_texts(self, ids: list[str]) -> dict[str, str]:
+        """Chunk text by point id, from the local cache or Qdrant (one retrieve call for the misses)."""
+        with self._texts_lock:
+            texts = {i: self._texts[i] for i in ids if i in self._texts}
+        missing = [i for i in ids if i not in texts]
+        if missing:
+            points = self.client.retrieve(
+                collection_name=self.collection,
+                ids=missing,
+                with_payload=["text"],
+                with_vectors=False,
+            )
+            for point in points:
+                texts[str(point.id)] = (point.payload or {}).get("text", "")
+        with self._texts_lock:
+            for i, text in texts.items():
+                self._texts[i] = text
+                self._texts.move_to_end(i)
+            while len(self._texts) > settings.CHUNK_TEXT_CACHE_SIZE:
+                self._texts.popitem(last=False)
+        return texts
+
 
-async def add_chunks_to_vector_db(chunks: list[dict]) -> None:
-    """Upsert chunk vectors into Qdrant. Each chunk must have id (UUID), chunk_id, text, doc_name, vector."""
-    client = get_qdrant()
-    ensure_collection(client)
-    points = [
-        PointStruct(
-            id=chunk["id"],
-            vector=chunk["vector"],
-            payload={
-                "chunk_id": chunk["chunk_id"],
-                "text": chunk["text"],
-                "doc_name": chunk["doc_name"],
-            },
+class EmbeddedVectorStore:
+    """Single-node store backed by EmbeddedVectorIndex; no network round-trip per search."""
+
+    def __init__(self, path: str):
+        self.index = EmbeddedVectorIndex(
+            path,
+            dim=settings.EMBEDDING_DIMENSIONS,
+            hnsw_threshold=settings.EMBEDDED_HNSW_THRESHOLD,
         )
-        for chunk in chunks
-    ]
-    client.upsert(collection_name=settings.QDRANT_COLLECTION, points=points)
 
+    def ensure_collection(self):
+        pass
+
+    def upsert(self, chunks: list[dict], vectors: np.ndarray) -> None:
+        self.index.add(vectors, [{"id": str(chunk["id"]), **_chunk_payload(chunk)} for chunk in chunks])
+
+    def search(self, query_vector, top_k: int, doc_names: list[str] | None = None) -> list[dict]:
+        hits = self.index.search(query_vector, top_k, doc_names=doc_names)
+        return [_hit(score, payload, payload.get("id")) for score, payload in hits]
+
+    def fetch_texts(self, ids: list[str]) -> dict[str, str]:
+        # Payloads live in process memory, so search results always carry their text
+        return {}
+
+
+def ensure_collection(store=None):
+    """Create the collection if it does not exist."""
+    (store or get_vector_store()).ensure_collection()
+
+
+def _as_matrix(vectors) -> np.ndarray:
+    return np.ascontiguousarray(vectors, dtype=np.float32).reshape(len(vectors), -1)
 
-async def search_vector_db(query_vector: list[float], top_k: int | None = None, client: QdrantClient | None = None) -> list[dict]:
-    """Search the knowledge base by vector; returns list of {score, chunk_id, text, doc_name}."""
+
+async def add_chunks_to_vector_db(chunks: list[dict], vectors=None, store=None) -> None:
+    """Upsert chunks into the vector store. Each chunk must have id (UUID), chunk_id, text, doc_name.
+    vectors is a (len(chunks), dim) float32 array; if omitted, each chunk's "vector" is used.
+    """
+    if vectors is None:
+        vectors = [chunk["vector"] for chunk in chunks]
+    store = store or get_vector_store()
+    # Both block on Qdrant (upsert waits for the write), so keep them off the event loop
+    await asyncio.to_thread(store.ensure_collection)
+    await asyncio.to_thread(store.upsert, chunks, _as_matrix(vectors))
+
+
+async def search_vector_db(
+    query_vector: np.ndarray | list[float],
+    top_k: int | None = None,
+    client=None,
+    doc_names: list[str] | None = None,
+) -> list[dict]:
+    """Search the knowledge base by vector; returns list of {id, score, chunk_id, text, tokens, doc_name}.
+    `client` is a vector store from get_vector_store() (defaults to the configured one).
+    `doc_names` restricts the search to chunks of those documents.
+    With QDRANT_LAZY_TEXT, text may be None; fetch it with fetch_chunk_texts for the hits actually used.
+    """
     try:
         top_k = top_k or settings.VECTOR_SEARCH_TOP_K
-        client = client or get_qdrant()
-        response = client.query_points(
-            collection_name=settings.QDRANT_COLLECTION,
-            query=query_vector,
-            limit=top_k,
-        )
-        return [
-            {
-                "score": hit.score,
-                "chunk_id": hit.payload.get("chunk_id", str(hit.id)) if hit.payload else str(hit.id),
-                "text": hit.payload.get("text", "") if hit.payload else "",
-                "doc_name": hit.payload.get("doc_name", "") if hit.payload else "",
-            }
-            for hit in response.points
-        ]
-    except Exception as e:
-        print(f"Error searching vector database: {e}")
+        store = client or get_vector_store()
+        with VECTOR_SEARCH.time():
+            # The Qdrant client blocks; keep the event loop (and streams overlapping this search) running
+            return await asyncio.to_thread(store.search, query_vector, top_k, doc_names=doc_names)
+    except Exception:
+        logger.exception("Error searching vector database")
         return []
+
+
+async def fetch_chunk_texts(ids: list[str], client=None) -> dict[str, str]:
+    """Fetch chunk text for search hits returned without it; returns {point id: text}."""
+    try:
+        store = client or get_vector_store()
+        with VECTOR_FETCH.time():
+            return await asyncio.to_thread(store.fetch_texts, ids)
+    except Exception:
+        logger.exception("Error fetching chunk texts from vector database")
+        return {}
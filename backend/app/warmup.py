@@ -0,0 +1,105 @@
+"""Startup warm-up for the API server.
+
+Loads and exercises the slow dependencies in parallel right after startup, so the first
+chat doesn't pay for them: the embedding model (and tokenizer), the vector store, and the
+Ollama model (loaded into memory with a keep-alive ping on every backend). Each component
+is retried until it succeeds, since Qdrant or Ollama may still be starting; Ollama counts
+as warm once one backend is, and unreachable ones are left to the pool's probing. The server
+accepts requests meanwhile; /ready reports 503 until every component is warm.
+"""
+import asyncio
+import logging
+from time import perf_counter
+import numpy as np
+from app.config import settings
+from app.metrics import Gauge
+
+logger = logging.getLogger(__name__)
+
+# app.main imports this module before the rest of the app, so app import time counts towards startup
+STARTED_AT = perf_counter()
+
+_status: dict[str, str] = {}
+_ready_after: float | None = None
+
+
+async def _warm_embeddings():
+    from app.embeddings import warm_up
+    from app.assistants.assistant import fixed_prompt_tokens
+    await warm_up()
+    await asyncio.to_thread(fixed_prompt_tokens)  # loads the tokenizer too
+
+
+async def _warm_vector_store():
+    from app.vector_db import get_vector_store
+    store = get_vector_store()
+    await asyncio.to_thread(store.ensure_collection)
+    await asyncio.to_thread(store.search, np.zeros(settings.EMBEDDING_DIMENSIONS, dtype=np.float32), 1)
+
+
+async def _warm_ollama():
+    from app.ollama_client import get_pool, _is_backend_failure
+    pool = get_pool()
+    backends = [b for b in pool.backends if b.healthy] or pool.backends
+    # A chat request without messages only loads the model and sets how long it stays loaded.
+    # num_ctx must match real requests, or Ollama reloads the model on the first chat.
+    results = await asyncio.gather(*(
+        backend.client.chat(
+            model=settings.OLLAMA_MODEL,
+            messages=[],
+            options={'num_ctx': settings.OLLAMA_CONTEXT_LENGTH},
+            keep_alive=settings.OLLAMA_KEEP_ALIVE,
+        )
+        for backend in backends
+    ), return_exceptions=True)
+    failed = [(b, r) for b, r in zip(backends, results) if isinstance(r, Exception)]
+    if len(failed) == len(backends):
+        raise failed[0][1]
+    for backend, e in failed:
+        logger.warning("Ollama backend %s failed to warm up (%s), leaving it to health probes", backend.host, e)
+        if _is_backend_failure(e):
+            pool.eject(backend)
+
+
+COMPONENTS = {
+    'embeddings': _warm_embeddings,
+    'vector_store': _warm_vector_store,
+    'ollama': _warm_ollama,
+}
+
+
+async def _warm(name, warm, max_delay=30.0):
+    delay = 1.0
+    while True:
+        start = perf_counter()
+        try:
+            await warm()
+        except Exception as e:
+            _status[name] = f'error: {e}'
+            logger.warning("Warm-up of %s failed (%s), retrying in %.0fs", name, e, delay)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, max_delay)
+            continue
+        _status[name] = 'ready'
+        logger.info("Warmed up %s in %.2fs", name, perf_counter() - start)
+        return
+
+
+async def warm_up():
+    global _ready_after
+    for name in COMPONENTS:
+        _status[name] = 'warming'
+    await asyncio.gather(*(_warm(name, warm) for name, warm in COMPONENTS.items()))
+    _ready_after = perf_counter() - STARTED_AT
+    logger.info("Ready %.2fs after start", _ready_after)
+
+
+def is_ready() -> bool:
+    return _ready_after is not None
+
+
+def status() -> dict:
+    return {'ready': is_ready(), 'start_to_ready_seconds': _ready_after, 'components': dict(_status)}
+
+
+Gauge("app_start_to_ready_seconds", "Seconds from process start (app import) until warm-up finished", lambda: _ready_after or 0)
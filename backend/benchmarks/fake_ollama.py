@@ -0,0 +1,110 @@
+"""Stand-in Ollama server speaking the /api/chat NDJSON streaming protocol.
+
+First-pass requests (tools offered, last message from the user) answer with a
+QueryKnowledgeBaseTool call; requests after a tool result stream an answer.
+Timing is configurable so benchmarks can model a given model/GPU speed:
+
+    python -m benchmarks.fake_ollama --port 11435 --ttft 0.2 --tokens-per-sec 40
+"""
+import argparse
+import asyncio
+import json
+import random
+from datetime import datetime, UTC
+from fastapi import FastAPI, Request
+from fastapi.responses import Response, StreamingResponse
+
+WORDS = (
+    "the report describes how data pipelines are monitored deployed and retrained "
+    "with model versions tracked across environments while metrics guide decisions"
+).split()
+
+
+class FakeOllamaConfig:
+    ttft: float = 0.2
+    tokens_per_sec: float = 40.0
+    answer_tokens: int = 80
+    tool_call_prob: float = 1.0
+    error_rate: float = 0.0
+
+
+config = FakeOllamaConfig()
+app = FastAPI()
+
+
+def _chunk(model: str, message: dict, done: bool = False, **extra) -> str:
+    return json.dumps({
+        "model": model,
+        "created_at": datetime.now(UTC).isoformat(),
+        "message": {"role": "assistant", "content": "", **message},
+        "done": done,
+        **extra,
+    }) + "\n"
+
+
+def _wants_tool_call(body: dict) -> bool:
+    messages = body.get("messages") or []
+    return bool(body.get("tools")) and bool(messages) and messages[-1].get("role") == "user" and random.random() < config.tool_call_prob
+
+
+async def _stream(body: dict):
+    model = body.get("model", "fake")
+    await asyncio.sleep(config.ttft)
+    if _wants_tool_call(body):
+        question = next((m.get("content", "") for m in reversed(body["messages"]) if m.get("role") == "user"), "")
+        query = " ".join(question.split()[:5]) or "summary"
+        tool_call = {"function": {"name": "QueryKnowledgeBaseTool", "arguments": {"query_input": query}}}
+        yield _chunk(model, {"tool_calls": [tool_call]})
+        eval_count = 20
+    else:
+        delay = 1 / config.tokens_per_sec if config.tokens_per_sec > 0 else 0
+        for i in range(config.answer_tokens):
+            yield _chunk(model, {"content": random.choice(WORDS) + " "})
+            if i + 1 < config.answer_tokens:
+                await asyncio.sleep(delay)
+        eval_count = config.answer_tokens
+    yield _chunk(model, {}, done=True, done_reason="stop", eval_count=eval_count)
+
+
+@app.post("/api/chat")
+async def chat(request: Request):
+    body = await request.json()
+    if config.error_rate and random.random() < config.error_rate:
+        return StreamingResponse(iter([json.dumps({"error": "fake failure"}) + "\n"]), status_code=500)
+    if not body.get("messages"):
+        # Model load / keep-alive ping, as sent by the app's startup warm-up
+        return Response(_chunk(body.get("model", "fake"), {}, done=True, done_reason="load"), media_type="application/json")
+    return StreamingResponse(_stream(body), media_type="application/x-ndjson")
+
+
+@app.get("/api/tags")
+async def tags():
+    return {"models": [{"name": "fake", "model": "fake"}]}
+
+
+@app.get("/")
+async def root():
+    return "Ollama is running"
+
+
+def main():
+    import uvicorn
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--ttft", type=float, default=config.ttft, help="Seconds before the first chunk")
+    parser.add_argument("--tokens-per-sec", type=float, default=config.tokens_per_sec)
+    parser.add_argument("--answer-tokens", type=int, default=config.answer_tokens)
+    parser.add_argument("--tool-call-prob", type=float, default=config.tool_call_prob)
+    parser.add_argument("--error-rate", type=float, default=config.error_rate, help="Fraction of requests failing with HTTP 500")
+    args = parser.parse_args()
+    config.ttft = args.ttft
+    config.tokens_per_sec = args.tokens_per_sec
+    config.answer_tokens = args.answer_tokens
+    config.tool_call_prob = args.tool_call_prob
+    config.error_rate = args.error_rate
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,377 @@
+"""End-to-end load benchmark for the chat and indexing API.
+
+Starts the fake Ollama server and the FastAPI app (Qdrant in local in-memory mode,
+Redis-Stack on REDIS_HOST/REDIS_PORT, optionally started here), indexes a PDF, then
+drives a mix of chat sessions and uploads at a given concurrency. Reports RPS,
+client-side latency/TTFT percentiles and per-stage percentiles from /metrics.
+
+Run from backend/:
+
+    python -m benchmarks.run --concurrency 8 --duration 60
+    python -m benchmarks.run --save-baseline benchmarks/baseline.json
+    python -m benchmarks.run --compare benchmarks/baseline.json --tolerance 0.15
+    python -m benchmarks.run --workers 4 --env QDRANT_URL=http://localhost:6333   # multi-worker app.serve; also reports memory
+
+With --workers > 1 the app needs a Qdrant server the workers share (in-memory Qdrant would
+give every worker its own empty store), and per-stage percentiles are not reported, since
+each /metrics scrape reads whichever worker answers it.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+import httpx
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+DEFAULT_PDF = BACKEND_DIR / "data" / "big_data.pdf"
+
+QUESTIONS = [
+    "What is big data?",
+    "Summarize the main points of the document",
+    "What are the characteristics of big data?",
+    "How is big data stored and processed?",
+    "What tools are mentioned for data analysis?",
+    "What challenges does the document describe?",
+    "Explain the role of Hadoop",
+    "What does the document say about data privacy?",
+    "Which industries use big data analytics?",
+    "What are the benefits of big data?",
+]
+
+STAGE_METRICS = [
+    "llm_time_to_first_token_seconds",
+    "llm_generation_seconds",
+    "llm_queue_wait_seconds",
+    "embedding_seconds",
+    "vector_search_seconds",
+    "redis_seconds",
+    "indexing_stage_seconds",
+    "sse_queue_depth",
+]
+
+
+# PROCESSES
+def _start(cmd: list[str], env: dict | None = None) -> subprocess.Popen:
+    return subprocess.Popen(cmd, cwd=BACKEND_DIR, env={**os.environ, **(env or {})})
+
+
+def _process_tree(pid: int) -> list[int]:
+    pids, i = [pid], 0
+    while i < len(pids):
+        try:
+            children = Path(f"/proc/{pids[i]}/task/{pids[i]}/children").read_text().split()
+        except OSError:
+            children = []
+        pids.extend(int(c) for c in children)
+        i += 1
+    return pids
+
+
+def memory_usage(pid: int) -> dict | None:
+    """Total RSS and PSS (MiB) of a process and its descendants (Linux only).
+    PSS splits shared pages between the processes sharing them, so it shows copy-on-write sharing that RSS double counts.
+    """
+    totals = {"rss": 0, "pss": 0}
+    for p in _process_tree(pid):
+        try:
+            lines = Path(f"/proc/{p}/smaps_rollup").read_text().splitlines()
+        except OSError:
+            continue
+        for line in lines:
+            key, _, value = line.partition(":")
+            if key.lower() in totals:
+                totals[key.lower()] += int(value.split()[0])
+    return {k: round(v / 1024, 1) for k, v in totals.items()} if totals["rss"] else None
+
+
+def _stop(procs: list[subprocess.Popen]):
+    for p in reversed(procs):
+        p.terminate()
+    for p in procs:
+        try:
+            p.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            p.kill()
+
+
+async def _wait_ready(url: str, timeout: float = 120):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get(url)).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.5)
+    raise RuntimeError(f"{url} not ready after {timeout}s")
+
+
+# METRICS
+def parse_histograms(text: str) -> dict:
+    """Parse Prometheus text into {(metric, labels): [(upper_bound, cumulative_count), ...]}."""
+    histograms = defaultdict(list)
+    for line in text.splitlines():
+        if not line or line.startswith("#") or "_bucket{" not in line:
+            continue
+        series, value = line.rsplit(" ", 1)
+        name, labels = series.split("{", 1)
+        pairs = [p.split("=", 1) for p in labels.rstrip("}").split(",") if p]
+        le = next(v.strip('"') for k, v in pairs if k == "le")
+        key_labels = ",".join(f"{k}={v.strip(chr(34))}" for k, v in pairs if k != "le")
+        histograms[(name.removesuffix("_bucket"), key_labels)].append((float(le), float(value)))
+    return histograms
+
+
+def histogram_delta(before: dict, after: dict) -> dict:
+    delta = {}
+    for key, buckets in after.items():
+        prev = dict(before.get(key, []))
+        delta[key] = [(le, count - prev.get(le, 0)) for le, count in buckets]
+    return delta
+
+
+def histogram_quantile(q: float, buckets: list) -> float | None:
+    """Estimate a quantile by linear interpolation inside the bucket, like PromQL's histogram_quantile."""
+    total = buckets[-1][1] if buckets else 0
+    if total <= 0:
+        return None
+    rank = q * total
+    prev_le, prev_count = 0.0, 0.0
+    for le, count in buckets:
+        if count >= rank:
+            if le == float("inf"):
+                return prev_le
+            if count == prev_count:
+                return le
+            return prev_le + (le - prev_le) * (rank - prev_count) / (count - prev_count)
+        prev_le, prev_count = le, count
+    return prev_le
+
+
+def percentiles(values: list[float]) -> dict:
+    if not values:
+        return {}
+    values = sorted(values)
+    pick = lambda q: values[min(len(values) - 1, int(q * len(values)))]
+    return {"count": len(values), "p50": pick(0.50), "p95": pick(0.95), "p99": pick(0.99)}
+
+
+# WORKLOAD
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.completed = 0
+
+    def record(self, op: str, seconds: float):
+        self.latencies[op].append(seconds)
+
+    def error(self, op: str):
+        self.errors[op] += 1
+
+
+async def chat_session(client: httpx.AsyncClient, rec: Recorder, turns: int):
+    start = time.perf_counter()
+    res = await client.post("/chats")
+    rec.record("create_chat", time.perf_counter() - start)
+    if res.status_code != 200:
+        rec.error("create_chat")
+        return
+    chat_id = res.json()["id"]
+    for _ in range(turns):
+        start = time.perf_counter()
+        first = None
+        failed = False
+        async with client.stream("POST", f"/chats/{chat_id}", json={"message": random.choice(QUESTIONS)}) as stream:
+            if stream.status_code != 200:
+                failed = True
+            else:
+                async for line in stream.aiter_lines():
+                    if line.startswith("event: error"):
+                        failed = True
+                    if first is None and line.startswith("data:"):
+                        first = time.perf_counter() - start
+        if failed:
+            rec.error("chat_turn")
+            continue
+        rec.record("chat_turn", time.perf_counter() - start)
+        if first is not None:
+            rec.record("chat_ttft", first)
+
+
+async def upload(client: httpx.AsyncClient, rec: Recorder, pdf: Path):
+    start = time.perf_counter()
+    res = await client.post("/index", files={"file": (pdf.name, pdf.read_bytes(), "application/pdf")})
+    if res.status_code != 200:
+        rec.error("index")
+        return
+    rec.record("index", time.perf_counter() - start)
+
+
+async def worker(client, rec: Recorder, args, deadline: float):
+    while time.monotonic() < deadline:
+        try:
+            if random.random() < args.index_ratio:
+                await upload(client, rec, args.pdf)
+            else:
+                await chat_session(client, rec, args.turns)
+            rec.completed += 1
+        except httpx.HTTPError:
+            rec.error("transport")
+
+
+async def run_benchmark(args) -> dict:
+    async with httpx.AsyncClient(base_url=args.app_url, timeout=args.request_timeout) as client:
+        # Seed the knowledge base so searches return real chunks
+        seed = await client.post("/index", files={"file": (args.pdf.name, args.pdf.read_bytes(), "application/pdf")})
+        seed.raise_for_status()
+        # /metrics is per process, so with several workers before/after could come from different ones
+        scrape = args.workers <= 1
+        before = parse_histograms((await client.get("/metrics")).text) if scrape else {}
+        rec = Recorder()
+        started = time.monotonic()
+        deadline = started + args.duration
+        await asyncio.gather(*[worker(client, rec, args, deadline) for _ in range(args.concurrency)])
+        elapsed = time.monotonic() - started
+        after = parse_histograms((await client.get("/metrics")).text) if scrape else {}
+
+    stages = {}
+    for (name, labels), buckets in histogram_delta(before, after).items():
+        if name not in STAGE_METRICS or not buckets or buckets[-1][1] <= 0:
+            continue
+        key = f"{name}{{{labels}}}" if labels else name
+        stages[key] = {"count": int(buckets[-1][1]), **{f"p{int(q * 100)}": histogram_quantile(q, buckets) for q in (0.5, 0.95, 0.99)}}
+
+    return {
+        "config": {"concurrency": args.concurrency, "duration": args.duration, "turns": args.turns, "index_ratio": args.index_ratio},
+        "elapsed": elapsed,
+        "rps": {
+            "sessions": rec.completed / elapsed,
+            "chat_turns": len(rec.latencies["chat_turn"]) / elapsed,
+        },
+        "client": {op: percentiles(values) for op, values in rec.latencies.items()},
+        "stages": stages,
+        "errors": dict(rec.errors),
+    }
+
+
+# REPORTING
+def print_report(result: dict):
+    print(f"\nElapsed {result['elapsed']:.1f}s  sessions/s {result['rps']['sessions']:.2f}  chat turns/s {result['rps']['chat_turns']:.2f}")
+    if result.get("start_to_ready_seconds") is not None:
+        print(f"App start-to-ready {result['start_to_ready_seconds']:.2f}s")
+    if result.get("memory_mib"):
+        memory = result["memory_mib"]
+        print(f"App memory ({result['workers']} worker(s)): RSS {memory['rss']:.0f} MiB, PSS {memory['pss']:.0f} MiB")
+    if result["errors"]:
+        print(f"Errors: {result['errors']}")
+    for section in ("client", "stages"):
+        print(f"\n{section.upper():<60} {'count':>7} {'p50':>9} {'p95':>9} {'p99':>9}")
+        for name, stats in sorted(result[section].items()):
+            fmt = lambda v: f"{v:9.4f}" if v is not None else f"{'-':>9}"
+            print(f"{name:<60} {stats['count']:>7} {fmt(stats['p50'])} {fmt(stats['p95'])} {fmt(stats['p99'])}")
+
+
+def compare(result: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Return regressions: p95 latencies above baseline * (1 + tolerance), or throughput below baseline / (1 + tolerance)."""
+    regressions = []
+    for section in ("client", "stages"):
+        for name, base in baseline.get(section, {}).items():
+            current = result[section].get(name)
+            if not current or base.get("p95") is None or current.get("p95") is None:
+                continue
+            if current["p95"] > base["p95"] * (1 + tolerance):
+                regressions.append(f"{section}.{name} p95 {current['p95']:.4f}s > baseline {base['p95']:.4f}s")
+    for name, base in baseline.get("rps", {}).items():
+        current = result["rps"].get(name, 0)
+        if base and current < base / (1 + tolerance):
+            regressions.append(f"rps.{name} {current:.2f} < baseline {base:.2f}")
+    base, current = baseline.get("start_to_ready_seconds"), result.get("start_to_ready_seconds")
+    if base and current and current > base * (1 + tolerance):
+        regressions.append(f"start_to_ready_seconds {current:.2f}s > baseline {base:.2f}s")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=30, help="Seconds of measured load")
+    parser.add_argument("--turns", type=int, default=2, help="Messages per chat session")
+    parser.add_argument("--index-ratio", type=float, default=0.05, help="Fraction of sessions that upload the PDF instead of chatting")
+    parser.add_argument("--pdf", type=Path, default=DEFAULT_PDF)
+    parser.add_argument("--request-timeout", type=float, default=300)
+    parser.add_argument("--app-url", help="Benchmark an already running app instead of starting one")
+    parser.add_argument("--app-port", type=int, default=8100)
+    parser.add_argument("--workers", type=int, default=1, help="API worker processes (app.serve)")
+    parser.add_argument("--ollama-port", type=int, default=11435)
+    parser.add_argument("--ollama-ttft", type=float, default=0.2)
+    parser.add_argument("--ollama-tokens-per-sec", type=float, default=40)
+    parser.add_argument("--start-redis", action="store_true", help="Start redis-stack-server on REDIS_PORT (must be on PATH)")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="Extra settings for the app process")
+    parser.add_argument("--save-baseline", type=Path)
+    parser.add_argument("--compare", type=Path, help="Baseline file to compare against; exits 1 on regression")
+    parser.add_argument("--tolerance", type=float, default=0.15)
+    args = parser.parse_args()
+    app_env = dict(kv.split("=", 1) for kv in args.env)
+    if args.workers > 1 and not args.app_url and app_env.get("QDRANT_URL", ":memory:") == ":memory:":
+        parser.error("--workers > 1 needs a Qdrant server shared by the workers: pass --env QDRANT_URL=http://...")
+
+    procs = []
+    try:
+        started_app = not args.app_url
+        if started_app:
+            redis_port = os.environ.get("REDIS_PORT", "6379")
+            if args.start_redis:
+                if not shutil.which("redis-stack-server"):
+                    sys.exit("redis-stack-server not found on PATH")
+                procs.append(_start(["redis-stack-server", "--port", redis_port, "--save", ""]))
+            procs.append(_start([
+                sys.executable, "-m", "benchmarks.fake_ollama", "--port", str(args.ollama_port),
+                "--ttft", str(args.ollama_ttft), "--tokens-per-sec", str(args.ollama_tokens_per_sec),
+            ]))
+            env = {
+                "OLLAMA_HOST": f"http://127.0.0.1:{args.ollama_port}",
+                "QDRANT_URL": ":memory:",
+                "QDRANT_COLLECTION": "benchmark_documents",
+                "REDIS_PORT": redis_port,
+                "LOG_LEVEL": "WARNING",
+                **app_env,
+            }
+            app_proc = _start([sys.executable, "-m", "app.serve", "--host", "127.0.0.1", "--port", str(args.app_port), "--workers", str(args.workers)], env)
+            procs.append(app_proc)
+            args.app_url = f"http://127.0.0.1:{args.app_port}"
+            asyncio.run(_wait_ready(f"http://127.0.0.1:{args.ollama_port}/api/tags"))
+        # Measured from process launch when the app was started here (waits on warm-up via /ready)
+        start = time.monotonic()
+        asyncio.run(_wait_ready(f"{args.app_url}/ready"))
+        startup = time.monotonic() - start
+        result = asyncio.run(run_benchmark(args))
+        if started_app:
+            result["start_to_ready_seconds"] = round(startup, 2)
+            result["workers"] = args.workers
+            result["memory_mib"] = memory_usage(app_proc.pid)
+    finally:
+        _stop(procs)
+
+    print_report(result)
+    if args.save_baseline:
+        args.save_baseline.write_text(json.dumps(result, indent=2))
+        print(f"\nBaseline saved to {args.save_baseline}")
+    if args.compare:
+        regressions = compare(result, json.loads(args.compare.read_text()), args.tolerance)
+        if regressions:
+            print("\nREGRESSIONS:\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+        print(f"\nNo regressions against {args.compare} (tolerance {args.tolerance:.0%})")
+
+
+if __name__ == "__main__":
+    main()
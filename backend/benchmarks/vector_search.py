@@ -0,0 +1,78 @@
+"""Compare vector search latency of the embedded index against Qdrant.
+
+Loads N random normalized vectors (EMBEDDING_DIMENSIONS wide) into both stores and
+times top-k queries. Qdrant defaults to local in-memory mode; pass --qdrant-url to
+measure a real server (including its network round-trip).
+
+    python -m benchmarks.vector_search --vectors 5000 --queries 500
+    python -m benchmarks.vector_search --qdrant-url http://localhost:6333
+"""
+import argparse
+import tempfile
+import time
+from uuid import uuid4
+import numpy as np
+from qdrant_client import QdrantClient
+from app.config import settings
+from app.vector_db import QdrantVectorStore, EmbeddedVectorStore
+from benchmarks.run import percentiles
+
+
+def _chunks(count: int) -> list[dict]:
+    return [
+        {"id": uuid4(), "chunk_id": f"bench:{i:06}", "text": f"chunk {i}", "doc_name": "bench"}
+        for i in range(count)
+    ]
+
+
+def _time_queries(store, queries: np.ndarray, top_k: int) -> dict:
+    store.search(queries[0], top_k)  # warm-up
+    latencies = []
+    for q in queries:
+        start = time.perf_counter()
+        store.search(q, top_k)
+        latencies.append(time.perf_counter() - start)
+    return percentiles(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vectors", type=int, default=5000)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--top-k", type=int, default=settings.VECTOR_SEARCH_TOP_K)
+    parser.add_argument("--qdrant-url", help="Qdrant server URL (default: local in-memory mode)")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    dim = settings.EMBEDDING_DIMENSIONS
+    vectors = rng.standard_normal((args.vectors, dim), dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    queries = rng.standard_normal((args.queries, dim), dtype=np.float32)
+    chunks = _chunks(len(vectors))
+
+    client = QdrantClient(url=args.qdrant_url) if args.qdrant_url else QdrantClient(location=":memory:")
+    collection = f"benchmark_{uuid4().hex[:8]}"
+    stores = {"qdrant": QdrantVectorStore(client, collection=collection)}
+    with tempfile.TemporaryDirectory() as index_dir:
+        stores["embedded"] = EmbeddedVectorStore(index_dir)
+        try:
+            results = {}
+            for name, store in stores.items():
+                store.ensure_collection()
+                start = time.perf_counter()
+                for i in range(0, len(chunks), args.batch_size):
+                    store.upsert(chunks[i:i + args.batch_size], vectors[i:i + args.batch_size])
+                load = time.perf_counter() - start
+                results[name] = {"load_seconds": load, **_time_queries(store, queries, args.top_k)}
+        finally:
+            client.delete_collection(collection)
+
+    print(f"{args.vectors} vectors x {dim} dims, {args.queries} queries, top_k={args.top_k}")
+    print(f"{'store':<10} {'load s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for name, r in results.items():
+        print(f"{name:<10} {r['load_seconds']:8.2f} {r['p50'] * 1000:8.3f} {r['p95'] * 1000:8.3f} {r['p99'] * 1000:8.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -9,6 +9,7 @@ export async function* parseSSEStream(stream) {
   while (true) {
     const { done, value } = await sseReader.read();
     if (done) break;
+    if (value.event === 'error') throw new Error(value.data);
     yield value.data;
   }
 }
\ No newline at end of file